@@ -0,0 +1,71 @@
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = '002'
+down_revision: Union[str, None] = '001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # halfvec stores 2 bytes per dimension: 768 bytes per 384-d embedding instead of 1536
+    op.execute('DROP INDEX IF EXISTS idx_posts_ml_embedding')
+    op.execute('DROP INDEX IF EXISTS idx_user_preferences_embedding')
+
+    op.execute("""
+               ALTER TABLE posts_ml
+                   ALTER COLUMN embedding TYPE halfvec(384)
+                   USING embedding::halfvec(384)
+               """)
+
+    op.execute("""
+               ALTER TABLE user_preferences
+                   ALTER COLUMN preference_embedding TYPE halfvec(384)
+                   USING preference_embedding::halfvec(384)
+               """)
+
+    op.execute("""
+               CREATE INDEX idx_posts_ml_embedding
+                   ON posts_ml
+                       USING ivfflat (embedding halfvec_cosine_ops)
+                   WITH (lists = 100)
+               """)
+
+    op.execute("""
+               CREATE INDEX idx_user_preferences_embedding
+                   ON user_preferences
+                       USING ivfflat (preference_embedding halfvec_cosine_ops)
+                   WITH (lists = 100)
+               """)
+
+
+def downgrade() -> None:
+    op.execute('DROP INDEX IF EXISTS idx_posts_ml_embedding')
+    op.execute('DROP INDEX IF EXISTS idx_user_preferences_embedding')
+
+    op.execute("""
+               ALTER TABLE posts_ml
+                   ALTER COLUMN embedding TYPE vector(384)
+                   USING embedding::vector(384)
+               """)
+
+    op.execute("""
+               ALTER TABLE user_preferences
+                   ALTER COLUMN preference_embedding TYPE vector(384)
+                   USING preference_embedding::vector(384)
+               """)
+
+    op.execute("""
+               CREATE INDEX idx_posts_ml_embedding
+                   ON posts_ml
+                       USING ivfflat (embedding vector_cosine_ops)
+                   WITH (lists = 100)
+               """)
+
+    op.execute("""
+               CREATE INDEX idx_user_preferences_embedding
+                   ON user_preferences
+                       USING ivfflat (preference_embedding vector_cosine_ops)
+                   WITH (lists = 100)
+               """)
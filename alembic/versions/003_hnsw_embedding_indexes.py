@@ -0,0 +1,49 @@
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = '003'
+down_revision: Union[str, None] = '002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # graph build has to fit in maintenance_work_mem, otherwise it spills and slows down a lot
+    op.execute("SET maintenance_work_mem = '512MB'")
+
+    op.execute('DROP INDEX IF EXISTS idx_posts_ml_embedding')
+    op.execute('DROP INDEX IF EXISTS idx_user_preferences_embedding')
+
+    op.execute("""
+               CREATE INDEX idx_posts_ml_embedding
+                   ON posts_ml
+                       USING hnsw (embedding halfvec_cosine_ops)
+                   WITH (m = 16, ef_construction = 64)
+               """)
+
+    op.execute("""
+               CREATE INDEX idx_user_preferences_embedding
+                   ON user_preferences
+                       USING hnsw (preference_embedding halfvec_cosine_ops)
+                   WITH (m = 16, ef_construction = 64)
+               """)
+
+
+def downgrade() -> None:
+    op.execute('DROP INDEX IF EXISTS idx_posts_ml_embedding')
+    op.execute('DROP INDEX IF EXISTS idx_user_preferences_embedding')
+
+    op.execute("""
+               CREATE INDEX idx_posts_ml_embedding
+                   ON posts_ml
+                       USING ivfflat (embedding halfvec_cosine_ops)
+                   WITH (lists = 100)
+               """)
+
+    op.execute("""
+               CREATE INDEX idx_user_preferences_embedding
+                   ON user_preferences
+                       USING ivfflat (preference_embedding halfvec_cosine_ops)
+                   WITH (lists = 100)
+               """)
@@ -0,0 +1,30 @@
+from datetime import datetime, timedelta
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = '004'
+down_revision: Union[str, None] = '003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+RECOMMENDATION_WINDOW_DAYS = 30
+
+
+def upgrade() -> None:
+    # the predicate must be a constant; app.database.maintenance rolls the cutoff forward every month
+    month_start = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    cutoff = month_start - timedelta(days=RECOMMENDATION_WINDOW_DAYS)
+
+    op.execute("SET maintenance_work_mem = '512MB'")
+    op.execute(f"""
+               CREATE INDEX idx_posts_ml_embedding_recent
+                   ON posts_ml
+                       USING hnsw (embedding halfvec_cosine_ops)
+                   WITH (m = 16, ef_construction = 64)
+                   WHERE created_at > '{cutoff:%Y-%m-%d %H:%M:%S}'::timestamp
+               """)
+
+
+def downgrade() -> None:
+    op.execute('DROP INDEX IF EXISTS idx_posts_ml_embedding_recent')
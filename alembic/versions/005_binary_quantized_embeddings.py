@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = '005'
+down_revision: Union[str, None] = '004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+RECOMMENDATION_WINDOW_DAYS = 30
+
+
+def upgrade() -> None:
+    month_start = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    cutoff = month_start - timedelta(days=RECOMMENDATION_WINDOW_DAYS)
+
+    # sign bits of the embedding: 48 bytes per post, compared with popcount Hamming distance
+    op.execute("""
+               ALTER TABLE posts_ml
+                   ADD COLUMN embedding_bin bit(384)
+                   GENERATED ALWAYS AS (binary_quantize(embedding)::bit(384)) STORED
+               """)
+
+    # candidates now come from the binary index, exact distances are computed on the shortlist only
+    op.execute('DROP INDEX IF EXISTS idx_posts_ml_embedding_recent')
+
+    op.execute("SET maintenance_work_mem = '512MB'")
+    op.execute(f"""
+               CREATE INDEX idx_posts_ml_embedding_bin_recent
+                   ON posts_ml
+                       USING hnsw (embedding_bin bit_hamming_ops)
+                   WITH (m = 16, ef_construction = 64)
+                   WHERE created_at > '{cutoff:%Y-%m-%d %H:%M:%S}'::timestamp
+               """)
+
+
+def downgrade() -> None:
+    month_start = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    cutoff = month_start - timedelta(days=RECOMMENDATION_WINDOW_DAYS)
+
+    op.execute('DROP INDEX IF EXISTS idx_posts_ml_embedding_bin_recent')
+    op.execute('ALTER TABLE posts_ml DROP COLUMN IF EXISTS embedding_bin')
+
+    op.execute("SET maintenance_work_mem = '512MB'")
+    op.execute(f"""
+               CREATE INDEX idx_posts_ml_embedding_recent
+                   ON posts_ml
+                       USING hnsw (embedding halfvec_cosine_ops)
+                   WITH (m = 16, ef_construction = 64)
+                   WHERE created_at > '{cutoff:%Y-%m-%d %H:%M:%S}'::timestamp
+               """)
@@ -0,0 +1,75 @@
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = '006'
+down_revision: Union[str, None] = '005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+REACTION_PARTITIONS = 16
+
+
+def upgrade() -> None:
+    op.execute('ALTER TABLE reactions_ml RENAME TO reactions_ml_old')
+
+    # every reaction lookup filters on author_id, so each user's rows live in one partition
+    op.execute("""
+               CREATE TABLE reactions_ml
+               (
+                   id         BIGINT       NOT NULL,
+                   target_id  BIGINT       NOT NULL,
+                   author_id  VARCHAR(255) NOT NULL,
+                   type       VARCHAR(20)  NOT NULL,
+                   created_at TIMESTAMP    NOT NULL
+               ) PARTITION BY HASH (author_id)
+               """)
+
+    for remainder in range(REACTION_PARTITIONS):
+        op.execute(f"""
+                   CREATE TABLE reactions_ml_p{remainder}
+                       PARTITION OF reactions_ml
+                       FOR VALUES WITH (MODULUS {REACTION_PARTITIONS}, REMAINDER {remainder})
+                   """)
+
+    op.execute("""
+               INSERT INTO reactions_ml (id, target_id, author_id, type, created_at)
+               SELECT id, target_id, author_id, type, created_at
+               FROM reactions_ml_old
+               """)
+    op.execute('DROP TABLE reactions_ml_old')
+
+    # a unique constraint on a partitioned table has to include the partition key
+    op.execute('ALTER TABLE reactions_ml ADD PRIMARY KEY (id, author_id)')
+    op.create_index('idx_reactions_ml_author_id', 'reactions_ml', ['author_id'], unique=False)
+    op.create_index('idx_reactions_ml_target_id', 'reactions_ml', ['target_id'], unique=False)
+
+    op.execute('ANALYZE reactions_ml')
+
+
+def downgrade() -> None:
+    op.execute('ALTER TABLE reactions_ml RENAME TO reactions_ml_partitioned')
+    op.execute('ALTER INDEX idx_reactions_ml_author_id RENAME TO idx_reactions_ml_partitioned_author_id')
+    op.execute('ALTER INDEX idx_reactions_ml_target_id RENAME TO idx_reactions_ml_partitioned_target_id')
+    op.execute('ALTER TABLE reactions_ml_partitioned RENAME CONSTRAINT reactions_ml_pkey TO reactions_ml_partitioned_pkey')
+
+    op.execute("""
+               CREATE TABLE reactions_ml
+               (
+                   id         BIGINT       NOT NULL,
+                   target_id  BIGINT       NOT NULL,
+                   author_id  VARCHAR(255) NOT NULL,
+                   type       VARCHAR(20)  NOT NULL,
+                   created_at TIMESTAMP    NOT NULL
+               )
+               """)
+    op.execute("""
+               INSERT INTO reactions_ml (id, target_id, author_id, type, created_at)
+               SELECT id, target_id, author_id, type, created_at
+               FROM reactions_ml_partitioned
+               """)
+    op.execute('DROP TABLE reactions_ml_partitioned')
+
+    op.execute('ALTER TABLE reactions_ml ADD PRIMARY KEY (id)')
+    op.create_index('idx_reactions_ml_author_id', 'reactions_ml', ['author_id'], unique=False)
+    op.create_index('idx_reactions_ml_target_id', 'reactions_ml', ['target_id'], unique=False)
@@ -0,0 +1,147 @@
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = '007'
+down_revision: Union[str, None] = '006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+REACTION_PARTITIONS = 16
+
+
+def _create_reactions_table(author_id_type: str) -> None:
+    op.execute(f"""
+               CREATE TABLE reactions_ml
+               (
+                   id         BIGINT       NOT NULL,
+                   target_id  BIGINT       NOT NULL,
+                   author_id  {author_id_type} NOT NULL,
+                   type       VARCHAR(20)  NOT NULL,
+                   created_at TIMESTAMP    NOT NULL
+               ) PARTITION BY HASH (author_id)
+               """)
+
+    for remainder in range(REACTION_PARTITIONS):
+        op.execute(f"""
+                   CREATE TABLE reactions_ml_p{remainder}
+                       PARTITION OF reactions_ml
+                       FOR VALUES WITH (MODULUS {REACTION_PARTITIONS}, REMAINDER {remainder})
+                   """)
+
+
+def upgrade() -> None:
+    op.execute("""
+               CREATE TABLE users_ml
+               (
+                   id          SERIAL PRIMARY KEY,
+                   external_id VARCHAR(255) NOT NULL UNIQUE
+               )
+               """)
+
+    op.execute("""
+               INSERT INTO users_ml (external_id)
+               SELECT author_id FROM posts_ml
+               UNION
+               SELECT author_id FROM reactions_ml
+               UNION
+               SELECT user_id FROM user_preferences
+               """)
+
+    # posts_ml
+    op.execute('ALTER TABLE posts_ml ADD COLUMN author_uid INTEGER')
+    op.execute("""
+               UPDATE posts_ml
+               SET author_uid = u.id
+               FROM users_ml u
+               WHERE u.external_id = posts_ml.author_id
+               """)
+    op.execute('ALTER TABLE posts_ml DROP COLUMN author_id')
+    op.execute('ALTER TABLE posts_ml RENAME COLUMN author_uid TO author_id')
+    op.execute('ALTER TABLE posts_ml ALTER COLUMN author_id SET NOT NULL')
+    op.create_foreign_key('fk_posts_ml_author_id', 'posts_ml', 'users_ml', ['author_id'], ['id'])
+    op.create_index('idx_posts_ml_author_id', 'posts_ml', ['author_id'], unique=False)
+
+    # reactions_ml: the partition key can't change type in place, so rebuild the partitions
+    op.execute("""
+               CREATE TEMP TABLE reactions_ml_old ON COMMIT DROP AS
+               SELECT r.id, r.target_id, u.id AS author_id, r.type, r.created_at
+               FROM reactions_ml r
+               JOIN users_ml u ON u.external_id = r.author_id
+               """)
+    op.execute('DROP TABLE reactions_ml')
+    _create_reactions_table('INTEGER')
+    op.execute("""
+               INSERT INTO reactions_ml (id, target_id, author_id, type, created_at)
+               SELECT id, target_id, author_id, type, created_at
+               FROM reactions_ml_old
+               """)
+    op.execute('ALTER TABLE reactions_ml ADD PRIMARY KEY (id, author_id)')
+    op.create_foreign_key('fk_reactions_ml_author_id', 'reactions_ml', 'users_ml', ['author_id'], ['id'])
+    op.create_index('idx_reactions_ml_author_id', 'reactions_ml', ['author_id'], unique=False)
+    op.create_index('idx_reactions_ml_target_id', 'reactions_ml', ['target_id'], unique=False)
+
+    # user_preferences
+    op.execute('ALTER TABLE user_preferences ADD COLUMN user_uid INTEGER')
+    op.execute("""
+               UPDATE user_preferences
+               SET user_uid = u.id
+               FROM users_ml u
+               WHERE u.external_id = user_preferences.user_id
+               """)
+    op.execute('ALTER TABLE user_preferences DROP COLUMN user_id')
+    op.execute('ALTER TABLE user_preferences RENAME COLUMN user_uid TO user_id')
+    op.execute('ALTER TABLE user_preferences ADD PRIMARY KEY (user_id)')
+    op.create_foreign_key('fk_user_preferences_user_id', 'user_preferences', 'users_ml', ['user_id'], ['id'])
+
+    op.execute('ANALYZE posts_ml')
+    op.execute('ANALYZE reactions_ml')
+    op.execute('ANALYZE user_preferences')
+
+
+def downgrade() -> None:
+    # user_preferences
+    op.execute('ALTER TABLE user_preferences ADD COLUMN user_ext VARCHAR(255)')
+    op.execute("""
+               UPDATE user_preferences
+               SET user_ext = u.external_id
+               FROM users_ml u
+               WHERE u.id = user_preferences.user_id
+               """)
+    op.execute('ALTER TABLE user_preferences DROP COLUMN user_id')
+    op.execute('ALTER TABLE user_preferences RENAME COLUMN user_ext TO user_id')
+    op.execute('ALTER TABLE user_preferences ADD PRIMARY KEY (user_id)')
+    op.create_index('idx_user_preferences_user_id', 'user_preferences', ['user_id'], unique=False)
+
+    # reactions_ml
+    op.execute("""
+               CREATE TEMP TABLE reactions_ml_old ON COMMIT DROP AS
+               SELECT r.id, r.target_id, u.external_id AS author_id, r.type, r.created_at
+               FROM reactions_ml r
+               JOIN users_ml u ON u.id = r.author_id
+               """)
+    op.execute('DROP TABLE reactions_ml')
+    _create_reactions_table('VARCHAR(255)')
+    op.execute("""
+               INSERT INTO reactions_ml (id, target_id, author_id, type, created_at)
+               SELECT id, target_id, author_id, type, created_at
+               FROM reactions_ml_old
+               """)
+    op.execute('ALTER TABLE reactions_ml ADD PRIMARY KEY (id, author_id)')
+    op.create_index('idx_reactions_ml_author_id', 'reactions_ml', ['author_id'], unique=False)
+    op.create_index('idx_reactions_ml_target_id', 'reactions_ml', ['target_id'], unique=False)
+
+    # posts_ml
+    op.execute('ALTER TABLE posts_ml ADD COLUMN author_ext VARCHAR(255)')
+    op.execute("""
+               UPDATE posts_ml
+               SET author_ext = u.external_id
+               FROM users_ml u
+               WHERE u.id = posts_ml.author_id
+               """)
+    op.execute('ALTER TABLE posts_ml DROP COLUMN author_id')
+    op.execute('ALTER TABLE posts_ml RENAME COLUMN author_ext TO author_id')
+    op.execute('ALTER TABLE posts_ml ALTER COLUMN author_id SET NOT NULL')
+    op.create_index('idx_posts_ml_author_id', 'posts_ml', ['author_id'], unique=False)
+
+    op.execute('DROP TABLE users_ml')
@@ -0,0 +1,34 @@
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = '008'
+down_revision: Union[str, None] = '007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # candidates come from idx_posts_ml_embedding_bin_recent and preferences are read by user_id,
+    # nothing scans these two graphs anymore but every write still maintains them
+    with op.get_context().autocommit_block():
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS idx_posts_ml_embedding')
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS idx_user_preferences_embedding')
+
+
+def downgrade() -> None:
+    # alembic may go through PgBouncer, where a session SET outside a transaction lands on some other
+    # server connection; build inside the migration transaction instead, like 003 does
+    op.execute("SET LOCAL maintenance_work_mem = '512MB'")
+    op.execute("""
+               CREATE INDEX IF NOT EXISTS idx_posts_ml_embedding
+                   ON posts_ml
+                       USING hnsw (embedding halfvec_cosine_ops)
+                   WITH (m = 16, ef_construction = 64)
+               """)
+    op.execute("""
+               CREATE INDEX IF NOT EXISTS idx_user_preferences_embedding
+                   ON user_preferences
+                       USING hnsw (preference_embedding halfvec_cosine_ops)
+                   WITH (m = 16, ef_construction = 64)
+               """)
@@ -0,0 +1,30 @@
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = '009'
+down_revision: Union[str, None] = '008'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # JIT compilation costs more than it saves on short OLTP and vector queries; set per database
+    # so it also reaches server connections opened by PgBouncer, which can't pass startup settings
+    op.execute("""
+               DO $$
+               BEGIN
+                   EXECUTE format('ALTER DATABASE %I SET jit = off', current_database());
+               END
+               $$
+               """)
+
+
+def downgrade() -> None:
+    op.execute("""
+               DO $$
+               BEGIN
+                   EXECUTE format('ALTER DATABASE %I RESET jit', current_database());
+               END
+               $$
+               """)
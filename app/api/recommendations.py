@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Response, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from loguru import logger
 
@@ -7,20 +7,26 @@ from app.models.user import RecommendationRequest, RecommendationResponse
 from app.models.post import PostCreate, PostResponse
 from app.models.reaction import ReactionCreate
 from app.services.recommendation_service import recommendation_service
+from app.services.reaction_batcher import reaction_batcher
 
-router = APIRouter(prefix="/recommendations", tags=["recommendations"])
+router = APIRouter(
+    prefix="/recommendations",
+    tags=["recommendations"]
+)
 
 
-@router.post("/", response_model=RecommendationResponse)
+# response_model would re-validate every post on the way out; the schema is documented via responses instead
+@router.post("/", response_model=None, responses={200: {"model": RecommendationResponse}})
 async def get_recommendations(
         request: RecommendationRequest,
         session: AsyncSession = Depends(get_session)
-):
+) -> Response:
 
     try:
         logger.info(f"Getting recommendations for user {request.user_id}")
-        response = await recommendation_service.get_recommendations(request, session)
-        return response
+        body = await recommendation_service.get_recommendations(request, session)
+        # the service hands back the encoded JSON body, send it as is
+        return Response(content=body, media_type="application/json")
     except Exception as e:
         logger.error(f"Error getting recommendations: {e}")
         raise HTTPException(
@@ -46,15 +52,12 @@ async def create_post(
         )
 
 
-@router.post("/reactions", status_code=status.HTTP_201_CREATED)
-async def create_reaction(
-        reaction: ReactionCreate,
-        session: AsyncSession = Depends(get_session)
-):
+@router.post("/reactions", status_code=status.HTTP_202_ACCEPTED)
+async def create_reaction(reaction: ReactionCreate):
     try:
-        logger.info(f"Creating reaction {reaction.id}")
-        await recommendation_service.create_reaction(reaction, session)
-        return {"message": "Reaction created successfully"}
+        logger.info(f"Queueing reaction {reaction.id}")
+        await reaction_batcher.submit(reaction)
+        return {"message": "Reaction accepted"}
     except Exception as e:
         logger.error(f"Error creating reaction: {e}")
         raise HTTPException(
@@ -78,12 +81,8 @@ async def refresh_user_recommendations(
 ):
 
     try:
-        # Invalidate cache
-        recommendation_service._invalidate_user_cache(user_id)
-
-        # Recompute preferences
-        from app.ml.recommender import recommender
-        await recommender.get_user_preference_embedding(user_id, session)
+        # Recompute preferences and repopulate caches
+        await recommendation_service.refresh_user_preference(user_id, session)
 
         logger.info(f"Refreshed recommendations for user {user_id}")
         return {"message": f"Recommendations refreshed for user {user_id}"}
@@ -1,5 +1,6 @@
 from app.database.postgres import engine, get_session, init_db, close_db
-from app.database.models import Post, Reaction, UserPreference, Base
+from app.database.models import Post, Reaction, User, UserPreference, Base
+from app.database.users import user_directory, UserDirectory
 
 __all__ = [
     "engine",
@@ -8,6 +9,9 @@ __all__ = [
     "close_db",
     "Post",
     "Reaction",
+    "User",
     "UserPreference",
     "Base",
+    "user_directory",
+    "UserDirectory",
 ]
\ No newline at end of file
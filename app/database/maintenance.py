@@ -0,0 +1,80 @@
+"""Offline index upkeep, run monthly (e.g. from cron) rather than on app startup:
+
+    python -m app.database.maintenance
+
+Point POSTGRES_HOST at Postgres itself, not PgBouncer, so the session settings stay on one connection.
+"""
+import asyncio
+
+from loguru import logger
+from sqlalchemy import text
+
+from app.database.postgres import engine, recent_index_cutoff
+
+RECENT_INDEX = "idx_posts_ml_embedding_bin_recent"
+
+
+def configure_hnsw_params(vector_count: int) -> dict:
+    if vector_count < 100_000:
+        return {"m": 16, "ef_construction": 64}
+    elif vector_count < 1_000_000:
+        return {"m": 24, "ef_construction": 100}
+    else:
+        return {"m": 32, "ef_construction": 128}
+
+
+async def rebuild_recent_embedding_index(conn):
+    cutoff = f"{recent_index_cutoff():%Y-%m-%d %H:%M:%S}"
+
+    result = await conn.execute(text("SELECT reltuples FROM pg_class WHERE relname = 'posts_ml'"))
+    # reltuples is -1 for tables that were never analyzed
+    vector_count = max(int(result.scalar() or 0), 0)
+    params = configure_hnsw_params(vector_count)
+
+    result = await conn.execute(text("""
+        SELECT pg_get_expr(i.indpred, i.indrelid), c.reloptions
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = :index_name
+    """), {"index_name": RECENT_INDEX})
+    current = result.first()
+
+    wanted_options = [f"m={params['m']}", f"ef_construction={params['ef_construction']}"]
+    if current is not None and f"'{cutoff}'" in current[0] and sorted(current[1] or []) == sorted(wanted_options):
+        logger.info(f"{RECENT_INDEX} is current (posts after {cutoff}, {params})")
+        return
+
+    # build the replacement next to the live index, queries keep using the old one until the swap
+    logger.info(f"Rebuilding {RECENT_INDEX} for posts after {cutoff}, ~{vector_count} rows with {params}")
+    await conn.execute(text("SET maintenance_work_mem = '512MB'"))
+    # an interrupted run leaves an invalid index behind
+    await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {RECENT_INDEX}_new"))
+    await conn.execute(text(
+        f"CREATE INDEX CONCURRENTLY {RECENT_INDEX}_new ON posts_ml "
+        f"USING hnsw (embedding_bin bit_hamming_ops) "
+        f"WITH (m = {params['m']}, ef_construction = {params['ef_construction']}) "
+        f"WHERE created_at > '{cutoff}'::timestamp"
+    ))
+
+    # swap in one short transaction: queries never see posts_ml without a recent index, and a failed
+    # rename leaves the old index in place
+    raw_connection = await conn.get_raw_connection()
+    driver_connection = raw_connection.driver_connection
+    async with driver_connection.transaction():
+        await driver_connection.execute(f"DROP INDEX IF EXISTS {RECENT_INDEX}")
+        await driver_connection.execute(f"ALTER INDEX {RECENT_INDEX}_new RENAME TO {RECENT_INDEX}")
+    logger.info(f"Rebuilt {RECENT_INDEX}")
+
+
+async def main():
+    try:
+        # CONCURRENTLY can't run inside a transaction block
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await rebuild_recent_embedding_index(conn)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,19 +1,46 @@
 from datetime import datetime
-from sqlalchemy import Column, BigInteger, String, DateTime, Text
+from sqlalchemy import Column, BigInteger, Integer, String, DateTime, Text, Computed, ForeignKey
 from sqlalchemy.ext.declarative import declarative_base
-from pgvector.sqlalchemy import Vector
+from sqlalchemy.orm import deferred
+from pgvector.sqlalchemy import BIT, HALFVEC
 
 Base = declarative_base()
 
 
+class AsyncpgHalfVec(HALFVEC):
+    """halfvec that hands numpy arrays to the asyncpg binary codec instead of formatting text"""
+    cache_ok = True
+
+    def bind_processor(self, dialect):
+        if dialect.driver == "asyncpg":
+            return None
+        return super().bind_processor(dialect)
+
+    def result_processor(self, dialect, coltype):
+        if dialect.driver == "asyncpg":
+            return None
+        return super().result_processor(dialect, coltype)
+
+
+class User(Base):
+    __tablename__ = "users_ml"
+
+    id = Column(Integer, primary_key=True)
+    external_id = Column(String(255), nullable=False, unique=True)
+
+    def __repr__(self):
+        return f"<User(id={self.id}, external_id={self.external_id})>"
+
+
 class Post(Base):
     __tablename__ = "posts_ml"
 
     id = Column(BigInteger, primary_key=True)
-    author_id = Column(String(255), nullable=False, index=True)
+    author_id = Column(Integer, ForeignKey("users_ml.id"), nullable=False, index=True)
     text = Column(Text, nullable=True)
     photo_url = Column(String(500), nullable=True)
-    embedding = Column(Vector(384), nullable=True)
+    embedding = Column(AsyncpgHalfVec(384), nullable=True)
+    embedding_bin = deferred(Column(BIT(384), Computed("binary_quantize(embedding)::bit(384)", persisted=True)))
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
 
     def __repr__(self):
@@ -25,7 +52,8 @@ class Reaction(Base):
 
     id = Column(BigInteger, primary_key=True)
     target_id = Column(BigInteger, nullable=False, index=True)
-    author_id = Column(String(255), nullable=False, index=True)
+    # hash partition key, so it is part of the primary key
+    author_id = Column(Integer, ForeignKey("users_ml.id"), primary_key=True, index=True)
     type = Column(String(20), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
@@ -36,8 +64,8 @@ class Reaction(Base):
 class UserPreference(Base):
     __tablename__ = "user_preferences"
 
-    user_id = Column(String(255), primary_key=True, index=True)
-    preference_embedding = Column(Vector(384), nullable=True)
+    user_id = Column(Integer, ForeignKey("users_ml.id"), primary_key=True)
+    preference_embedding = Column(AsyncpgHalfVec(384), nullable=True)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def __repr__(self):
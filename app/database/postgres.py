@@ -1,19 +1,82 @@
+import struct
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+import numpy as np
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
-from sqlalchemy import text
+from sqlalchemy import event, text
+from pgvector.asyncpg import register_vector
 from config import settings
 from app.database.models import Base
 from loguru import logger
 
-#async engine with connection pooling
-engine = create_async_engine(
-    settings.DATABASE_URL,
-    echo=settings.DEBUG,
-    pool_size=20,  # connections to keep in pool
-    max_overflow=10,  # add connections if pool is exhausted
-    pool_timeout=30,  # sec to wait for connection from pool
-    pool_recycle=3600,  # recycle connections after 1 hour
-    pool_pre_ping=True,  # verify connections before using them
-)
+if settings.PGBOUNCER_ENABLED:
+    # PgBouncer (transaction pooling) multiplexes onto server connections; a small client pool
+    # still saves the reconnect and the codec introspection round trips on every session,
+    # idle client connections don't hold a server connection
+    engine = create_async_engine(
+        settings.DATABASE_URL,
+        echo=settings.DEBUG,
+        pool_size=settings.PGBOUNCER_CLIENT_POOL_SIZE,
+        max_overflow=settings.PGBOUNCER_CLIENT_POOL_SIZE,
+        pool_timeout=30,
+        pool_recycle=3600,
+        # no pre-ping round trip per checkout; a connection PgBouncer dropped fails once and is discarded
+        connect_args={
+            # named prepared statements don't survive transaction pooling
+            "prepared_statement_cache_size": 0,
+            "statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+        },
+    )
+else:
+    #async engine with connection pooling
+    engine = create_async_engine(
+        settings.DATABASE_URL,
+        echo=settings.DEBUG,
+        pool_size=20,  # connections to keep in pool
+        max_overflow=10,  # add connections if pool is exhausted
+        pool_timeout=30,  # sec to wait for connection from pool
+        pool_recycle=3600,  # recycle connections after 1 hour
+        pool_pre_ping=True,  # verify connections before using them
+        connect_args={
+            "prepared_statement_cache_size": 512,  # SQLAlchemy-side cache of asyncpg prepared statements
+            "statement_cache_size": 512,  # asyncpg-side cache of parsed statements
+            # JIT compilation costs more than it saves on short OLTP and vector queries;
+            # behind PgBouncer migration 009 sets it per database instead
+            "server_settings": {"jit": "off"},
+        },
+    )
+
+
+def encode_halfvec(value) -> bytes:
+    value = np.asarray(value, dtype='>f2')
+    return struct.pack('>HH', value.shape[0], 0) + value.tobytes()
+
+
+def decode_halfvec(data: bytes) -> np.ndarray:
+    # binary halfvec is a (dim, unused) header followed by big-endian fp16 values
+    dim, _ = struct.unpack_from('>HH', data)
+    return np.frombuffer(data, dtype='>f2', count=dim, offset=4).astype(np.float32)
+
+
+async def _register_codecs(conn):
+    await register_vector(conn)
+    # halfvec rows come back as float32 ndarrays rather than HalfVector wrappers
+    await conn.set_type_codec(
+        'halfvec',
+        schema='public',
+        encoder=encode_halfvec,
+        decoder=decode_halfvec,
+        format='binary'
+    )
+
+
+@event.listens_for(engine.sync_engine, "connect")
+def register_vector_codecs(dbapi_connection, connection_record):
+    # binary wire format for vector/halfvec, no text formatting or parsing of embeddings
+    dbapi_connection.run_async(_register_codecs)
+
 
 async_session_factory = async_sessionmaker(
     engine,
@@ -22,9 +85,16 @@ async_session_factory = async_sessionmaker(
 )
 
 
+def recent_index_cutoff(now: datetime | None = None) -> datetime:
+    # fixed for a whole month so queries over the last RECOMMENDATION_WINDOW_DAYS stay inside the index
+    now = now or datetime.utcnow()
+    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return month_start - timedelta(days=settings.RECOMMENDATION_WINDOW_DAYS)
+
+
 async def init_db():
     try:
-        async with engine.connect() as conn:
+        async with engine.begin() as conn:
             # test connection
             await conn.execute(text("SELECT 1"))
             logger.info("Database connection successful")
@@ -0,0 +1,97 @@
+from typing import Optional
+
+from cachetools import LRUCache
+from loguru import logger
+from sqlalchemy import String, bindparam, event, text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from config import settings
+
+# one round trip per batch of ids, both run on the caller's session and transaction
+SELECT_USERS = text("""
+    SELECT external_id, id FROM users_ml WHERE external_id = ANY(:external_ids)
+""").bindparams(bindparam("external_ids", type_=ARRAY(String)))
+
+# DO NOTHING only returns the rows this statement inserted, ids taken by a concurrent writer are re-read
+INSERT_USERS = text("""
+    INSERT INTO users_ml (external_id)
+    SELECT unnest(:external_ids)
+    ON CONFLICT (external_id) DO NOTHING
+    RETURNING external_id, id
+""").bindparams(bindparam("external_ids", type_=ARRAY(String)))
+
+# session.info key for ids inserted by a transaction that hasn't committed yet
+PENDING_USERS = "pending_users"
+
+
+class UserDirectory:
+    """Maps external string user ids to the int4 surrogate keys used in the ML tables"""
+
+    def __init__(self):
+        # the mapping never changes once assigned, so entries only leave the cache by eviction
+        self._ids: LRUCache = LRUCache(maxsize=settings.USER_ID_CACHE_SIZE)
+
+    async def lookup(self, external_id: str, session: AsyncSession) -> Optional[int]:
+        return (await self.lookup_many({external_id}, session)).get(external_id)
+
+    async def lookup_many(self, external_ids: set[str], session: AsyncSession) -> dict[str, int]:
+        # read paths only: unknown users are left out instead of registered
+        ids = {}
+        pending = session.info.get(PENDING_USERS, {})
+        missing = []
+        for external_id in external_ids:
+            user_id = self._ids.get(external_id) or pending.get(external_id)
+            if user_id is not None:
+                ids[external_id] = user_id
+            else:
+                missing.append(external_id)
+
+        if missing:
+            result = await session.execute(SELECT_USERS, {"external_ids": missing})
+            for external_id, user_id in result.all():
+                self._ids[external_id] = user_id
+                ids[external_id] = user_id
+
+        return ids
+
+    async def resolve(self, external_id: str, session: AsyncSession) -> int:
+        return (await self.resolve_many({external_id}, session))[external_id]
+
+    async def resolve_many(self, external_ids: set[str], session: AsyncSession) -> dict[str, int]:
+        # write paths: registers unknown users in the caller's transaction
+        ids = await self.lookup_many(external_ids, session)
+        missing = sorted(external_id for external_id in external_ids if external_id not in ids)
+        if not missing:
+            return ids
+
+        result = await session.execute(INSERT_USERS, {"external_ids": missing})
+        inserted = dict(result.all())
+        if inserted:
+            # cached only once the caller commits, a rollback must not leave ids that don't exist
+            session.info.setdefault(PENDING_USERS, {}).update(inserted)
+            ids.update(inserted)
+            logger.info(f"Registered {len(inserted)} users")
+
+        raced = {external_id for external_id in missing if external_id not in inserted}
+        if raced:
+            ids.update(await self.lookup_many(raced, session))
+
+        return ids
+
+    def _promote(self, session: Session):
+        self._ids.update(session.info.pop(PENDING_USERS, {}))
+
+
+user_directory = UserDirectory()
+
+
+@event.listens_for(Session, "after_commit")
+def _cache_registered_users(session: Session):
+    user_directory._promote(session)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_registered_users(session: Session):
+    session.info.pop(PENDING_USERS, None)
@@ -1,33 +1,121 @@
 import asyncio
-import json
-from datetime import datetime
+import asyncpg
+import ciso8601
+from datetime import datetime, timezone
+from typing import Optional
+import numpy as np
+import orjson
 from aiokafka import AIOKafkaConsumer
+from asyncpg.exceptions import _base as asyncpg_base
 from loguru import logger
-from sqlalchemy import select
+from sqlalchemy import bindparam, delete, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.database.postgres import async_session_factory
 from app.database.models import Post, Reaction
+from app.database.users import user_directory
 from app.ml.embeddings import embedding_model
-from app.ml.recommender import recommender
-from app.services import recommendation_service
+from app.services import preference_invalidator
 from config import settings
 
+# built once and reused for every event; bind names differ from the column names, which SET reserves
+UPDATE_POST = (
+    update(Post)
+    .where(Post.id == bindparam("post_id"))
+    .values(text=bindparam("new_text"), embedding=bindparam("new_embedding"))
+    .returning(Post.id)
+)
+DELETE_POST = delete(Post).where(Post.id == bindparam("post_id")).returning(Post.id)
+UPDATE_REACTION = (
+    update(Reaction)
+    .where(Reaction.id == bindparam("reaction_id"), Reaction.author_id == bindparam("author_uid"))
+    .values(type=bindparam("new_type"))
+    .returning(Reaction.id)
+)
+DELETE_REACTION = (
+    delete(Reaction)
+    .where(Reaction.id == bindparam("reaction_id"), Reaction.author_id == bindparam("author_uid"))
+    .returning(Reaction.id)
+)
+
+
+# the event itself is bad (missing field, wrong type, rejected value), replaying it can't help;
+# anything else (connection loss, timeouts, deadlocks) is retried
+PERMANENT_ERRORS = (KeyError, ValueError, TypeError, IntegrityError)
+# the asyncpg dialect surfaces rejected values as a generic DBAPIError (server-side SQLSTATE
+# class 22/23) or an InterfaceError (client-side argument encoding), so look at the driver error
+PERMANENT_DRIVER_ERRORS = (
+    asyncpg.exceptions.DataError,
+    asyncpg.exceptions.IntegrityConstraintViolationError,
+    asyncpg_base.DataError,
+)
+
+
+def is_permanent(error: BaseException) -> bool:
+    if isinstance(error, PERMANENT_ERRORS):
+        return True
+    # SQLAlchemy keeps the dialect's error in .orig, which chains the asyncpg one as __cause__
+    seen = set()
+    cause = getattr(error, 'orig', None) or error.__cause__
+    while cause is not None and id(cause) not in seen:
+        if isinstance(cause, PERMANENT_DRIVER_ERRORS):
+            return True
+        seen.add(id(cause))
+        cause = getattr(cause, 'orig', None) or cause.__cause__
+    return False
+
 
 def parse_timestamp(value) -> datetime:
-    if isinstance(value, (int, float)):
-        return datetime.fromtimestamp(value)
-    elif isinstance(value, str):
-        if 'Z' in value:
-            value = value.replace('Z', '+00:00')
-        return datetime.fromisoformat(value)
+    # events carry RFC 3339 strings almost always; ciso8601 parses them (including 'Z') in C
+    if type(value) is str:
+        parsed = ciso8601.parse_datetime(value)
+        # created_at columns are naive UTC timestamps; 'Z' and offset strings come back aware
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        return parsed
+    elif type(value) in (int, float):
+        return datetime.fromtimestamp(value, timezone.utc).replace(tzinfo=None)
     return value
 
 
+def deserialize_event(raw: Optional[bytes]):
+    # undecodable values become None and are dropped by _consume rather than failing the poll
+    try:
+        return orjson.loads(raw)
+    except (orjson.JSONDecodeError, TypeError) as e:
+        logger.warning(f"Undecodable Kafka message value: {e}")
+        return None
+
+
+def is_valid_event(value) -> bool:
+    return (
+        isinstance(value, dict)
+        and isinstance(value.get('eventType'), str)
+        and isinstance(value.get('payload'), dict)
+    )
+
+
 class KafkaConsumerService:
     def __init__(self):
         self.consumer = None
         self.running = False
+        self._consume_task: Optional[asyncio.Task] = None
+        # events of the current poll that failed transiently, and the keys queued behind them
+        self._retry: list[tuple] = []
+        self._deferred_keys: set = set()
+        self._shard_queues: list[asyncio.Queue] = []
+        self._shard_tasks: list[asyncio.Task] = []
+        # eventType -> handler; every handler takes (event, session, embedding)
+        self._handlers = {
+            'post.created': self._handle_post_created,
+            'post.updated': self._handle_post_updated,
+            'post.deleted': self._handle_post_deleted,
+            'reaction.created': self._handle_reaction_created,
+            'reaction.updated': self._handle_reaction_updated,
+            'reaction.deleted': self._handle_reaction_deleted,
+        }
 
     async def start(self):
         self.consumer = AIOKafkaConsumer(
@@ -36,214 +124,448 @@ class KafkaConsumerService:
             bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
             group_id=settings.KAFKA_GROUP_ID,
             auto_offset_reset=settings.KAFKA_AUTO_OFFSET_RESET,
-            enable_auto_commit=True,
-            value_deserializer=lambda m: json.loads(m.decode('utf-8'))
+            # offsets are committed by _consume once a poll has been fully handled
+            enable_auto_commit=False,
+            # the background fetcher keeps pulling while handlers run, larger fetches mean fewer round trips
+            fetch_max_bytes=settings.KAFKA_FETCH_MAX_BYTES,
+            max_partition_fetch_bytes=settings.KAFKA_MAX_PARTITION_FETCH_BYTES,
+            # orjson parses the raw bytes directly, no decode to str first
+            value_deserializer=deserialize_event
         )
 
         await self.consumer.start()
         self.running = True
         logger.info(f"Kafka consumer started (group: {settings.KAFKA_GROUP_ID})")
 
-        asyncio.create_task(self._consume())
+        self._shard_queues = [
+            asyncio.Queue(maxsize=settings.KAFKA_SHARD_QUEUE_SIZE) for _ in range(settings.KAFKA_HANDLER_SHARDS)
+        ]
+        self._shard_tasks = [asyncio.create_task(self._shard_worker(queue)) for queue in self._shard_queues]
+
+        self._consume_task = asyncio.create_task(self._consume())
+
+    def _key_of(self, message):
+        # events of one user (reactions) or one post must be applied in poll order
+        value = message.value
+        payload = value.get('payload') or {}
+        if value.get('eventType', '').startswith('reaction.'):
+            key = payload.get('authorId')
+        else:
+            key = payload.get('id')
+        if not isinstance(key, (str, int)):
+            key = message.key
+        return key
+
+    def _shard_of(self, message) -> int:
+        # same key, same worker
+        return hash(self._key_of(message)) % len(self._shard_queues)
+
+    async def _shard_worker(self, queue: asyncio.Queue):
+        while True:
+            # whatever has queued up behind the first message is written in the same transaction
+            items = [await queue.get()]
+            while len(items) < settings.KAFKA_MAX_POLL_RECORDS and not queue.empty():
+                items.append(queue.get_nowait())
+            try:
+                await self._process(items)
+            except Exception as e:
+                # a dead worker would leave its queue unjoined and stall every later poll; the writes
+                # are idempotent, so the chunk is retried with the poll's other failures
+                logger.error(f"Error in Kafka shard worker, retrying {len(items)} events: {e}")
+                self._retry.extend(items)
+                self._deferred_keys.update(self._key_of(message) for message, _ in items)
+            finally:
+                for _ in items:
+                    queue.task_done()
+
+    async def _process(self, items: list[tuple]):
+        # an event whose key has a deferred event waits behind it for the retry
+        ready = []
+        for item in items:
+            if self._key_of(item[0]) in self._deferred_keys:
+                self._retry.append(item)
+            else:
+                ready.append(item)
+        if not ready:
+            return
+
+        # one transaction (one WAL flush) per chunk; writes are idempotent, so a chunk that fails
+        # is replayed message by message to isolate the bad one instead of dropping its neighbours
+        try:
+            async with async_session_factory() as session, session.begin():
+                changed_authors = set()
+                for message, embedding in ready:
+                    changed_authors |= await self._dispatch(message, session, embedding)
+        except Exception as e:
+            if len(ready) == 1:
+                self._fail(ready[0], e)
+                return
+            logger.error(f"Error writing chunk of {len(ready)} events, retrying one by one: {e}")
+            for item in ready:
+                await self._process([item])
+            return
+
+        # only after commit, or the recompute could still read the old reactions
+        for author_id in changed_authors:
+            preference_invalidator.mark(author_id)
+
+    def _fail(self, item: tuple, error: Exception):
+        message = item[0]
+        where = f"{message.value.get('eventType', '')} event at {message.topic}[{message.partition}]@{message.offset}"
+        if is_permanent(error):
+            logger.error(f"Skipping {where}: {error}")
+            return
+
+        logger.warning(f"Error handling {where}, will retry: {error}")
+        self._deferred_keys.add(self._key_of(message))
+        self._retry.append(item)
+
+    async def _encode_post_texts(self, events: list[dict]) -> dict[int, np.ndarray]:
+        # one forward pass for every post text in the poll instead of one per message
+        indexed_texts = [
+            (i, event['payload']['text'])
+            for i, event in enumerate(events)
+            if event['eventType'] in ('post.created', 'post.updated')
+            and isinstance(event['payload'].get('text'), str)
+            and event['payload']['text'].strip()
+        ]
+        if not indexed_texts:
+            return {}
+
+        # reposts and create+update pairs repeat texts, each distinct text is encoded once
+        unique_texts = list(dict.fromkeys(text for _, text in indexed_texts))
+
+        try:
+            embeddings = await embedding_model.encode_async(unique_texts, batch_size=32)
+        except Exception as e:
+            # handlers fall back to encoding their own text
+            logger.error(f"Error encoding batch of {len(indexed_texts)} posts: {e}")
+            return {}
+
+        by_text = {text: embedding.astype(np.float16) for text, embedding in zip(unique_texts, embeddings)}
+        return {i: by_text[text] for i, text in indexed_texts}
 
     async def _consume(self):
         try:
-            async for message in self.consumer:
-                topic = message.topic
-                key = message.key.decode('utf-8') if message.key else None
-                value = message.value
-                event_type = value.get('eventType', '')
-
-                logger.info(f"Received {event_type} from {topic}, key: {key}")
-
-                try:
-                    # Route by eventType
-                    if event_type == 'post.created':
-                        await self._handle_post_created(value)
-                    elif event_type == 'post.updated':
-                        await self._handle_post_updated(value)
-                    elif event_type == 'post.deleted':
-                        await self._handle_post_deleted(value)
-                    elif event_type == 'reaction.created':
-                        await self._handle_reaction_created(value)
-                    elif event_type == 'reaction.updated':
-                        await self._handle_reaction_updated(value)
-                    elif event_type == 'reaction.deleted':
-                        await self._handle_reaction_deleted(value)
-                    else:
-                        logger.warning(f"Unknown event type: {event_type}")
-
-                except Exception as e:
-                    logger.error(f"Error handling {event_type} event: {e}")
+            while self.running:
+                batches = await self.consumer.getmany(
+                    timeout_ms=settings.KAFKA_POLL_TIMEOUT_MS,
+                    max_records=settings.KAFKA_MAX_POLL_RECORDS
+                )
+                messages = [message for records in batches.values() for message in records]
+                if not messages:
+                    continue
+
+                # a malformed event is skipped on its own; it must not reach the batch code and stop the loop
+                for message in messages:
+                    if not is_valid_event(message.value):
+                        logger.warning(
+                            f"Skipping malformed event at {message.topic}[{message.partition}]@{message.offset}"
+                        )
+                messages = [message for message in messages if is_valid_event(message.value)]
+
+                embeddings = await self._encode_post_texts([message.value for message in messages])
+                written = await self._write_created(messages, embeddings)
+
+                for i, message in enumerate(messages):
+                    if i not in written:
+                        await self._shard_queues[self._shard_of(message)].put((message, embeddings.get(i)))
+
+                # per-poll barrier: offsets are committed per poll, so the commit must not cover events
+                # still in flight. Shards overlap within a poll, but the slowest one holds up the next
+                # poll; KAFKA_MAX_POLL_RECORDS keeps a poll (and that wait) small
+                await asyncio.gather(*(queue.join() for queue in self._shard_queues))
+
+                # a poll is only committed once every event in it is written or skipped as permanent;
+                # on shutdown mid-retry the offsets stay put and the poll is redelivered
+                if await self._retry_failed():
+                    await self._commit_offsets()
 
         except Exception as e:
             logger.error(f"Fatal error in Kafka consumer: {e}")
             self.running = False
 
-    async def _handle_post_created(self, event: dict):
-        payload = event['payload']
-        post_id = payload['id']
-        text = payload.get('text')
-
-        created_at = parse_timestamp(payload['createdAt'])
+    async def _retry_failed(self) -> bool:
+        # only the transiently failed events (and those queued behind them) go through the
+        # shards again, with their embeddings; the rest of the poll isn't re-encoded or rewritten.
+        # Transient failures are never dropped: an outage stalls the consumer until the writes succeed
+        attempt = 0
+        while self._retry and self.running:
+            attempt += 1
+            retry, self._retry = self._retry, []
+            self._deferred_keys = set()
+            backoff_ms = min(settings.KAFKA_RETRY_BACKOFF_MS * attempt, settings.KAFKA_RETRY_BACKOFF_MAX_MS)
+            logger.warning(f"Retrying {len(retry)} events (attempt {attempt}) in {backoff_ms} ms")
+            await asyncio.sleep(backoff_ms / 1000)
+
+            # each shard's failures were collected in order, so per-key order still holds
+            for item in retry:
+                await self._shard_queues[self._shard_of(item[0])].put(item)
+            await asyncio.gather(*(queue.join() for queue in self._shard_queues))
+
+        if self._retry:
+            logger.warning(f"Stopping with {len(self._retry)} events unwritten, leaving their offsets uncommitted")
+            self._retry = []
+            self._deferred_keys = set()
+            return False
+        return True
+
+    async def _commit_offsets(self):
+        try:
+            await self.consumer.commit()
+        except Exception as e:
+            # e.g. a rebalance; the events are redelivered and the writes are idempotent
+            logger.error(f"Error committing Kafka offsets: {e}")
+
+    async def _write_created(self, messages: list, embeddings: dict[int, np.ndarray]) -> set[int]:
+        # creates in a poll become one multi-row insert per table, both in a single transaction;
+        # anything else, or a batch that fails, goes through the shard workers in poll order.
+        # The batch lands before the shards run, so a create queued behind an update or delete
+        # of the same key (e.g. a toggled reaction reusing its id) stays in the shards too
+        post_indexes = []
+        reaction_indexes = []
+        routed_keys = set()
+        for i, message in enumerate(messages):
+            event_type = message.value.get('eventType')
+            key = self._key_of(message)
+            if key in routed_keys:
+                continue
+            if event_type == 'post.created':
+                post_indexes.append(i)
+            elif event_type == 'reaction.created':
+                reaction_indexes.append(i)
+            else:
+                routed_keys.add(key)
 
-        async with async_session_factory() as session:
-            result = await session.execute(
-                select(Post).where(Post.id == post_id)
-            )
-            if result.scalar_one_or_none():
-                logger.warning(f"Post {post_id} already exists, skipping")
-                return
+        if len(post_indexes) < 2:
+            post_indexes = []
+        if len(reaction_indexes) < 2:
+            reaction_indexes = []
+        if not post_indexes and not reaction_indexes:
+            return set()
 
-            embedding = None
-            if text:
-                emb_array = embedding_model.encode(text)
+        changed_authors = set()
+        try:
+            async with async_session_factory() as session, session.begin():
+                if post_indexes:
+                    await self._handle_posts_created(
+                        [messages[i].value for i in post_indexes],
+                        [embeddings.get(i) for i in post_indexes],
+                        session
+                    )
+                if reaction_indexes:
+                    changed_authors = await self._handle_reactions_created(
+                        [messages[i].value for i in reaction_indexes],
+                        session
+                    )
+        except Exception as e:
+            logger.error(f"Error writing batch of {len(post_indexes)} posts and {len(reaction_indexes)} reactions: {e}")
+            return set()
+
+        for author_id in changed_authors:
+            preference_invalidator.mark(author_id)
+
+        return set(post_indexes) | set(reaction_indexes)
+
+    async def _dispatch(self, message, session: AsyncSession, embedding: Optional[np.ndarray] = None) -> set[str]:
+        # returns the authors whose preferences the event invalidates; errors propagate so the
+        # caller can roll back the shared transaction
+        topic = message.topic
+        key = message.key.decode('utf-8') if message.key else None
+        value = message.value
+        event_type = value.get('eventType', '')
+
+        logger.info(f"Received {event_type} from {topic}, key: {key}")
+
+        # Route by eventType
+        handler = self._handlers.get(event_type)
+        if handler is None:
+            logger.warning(f"Unknown event type: {event_type}")
+            return set()
+
+        return await handler(value, session, embedding) or set()
+
+    async def _handle_post_created(self, event: dict, session: AsyncSession, embedding: Optional[np.ndarray] = None):
+        await self._handle_posts_created([event], [embedding], session)
+
+    async def _handle_posts_created(
+        self,
+        events: list[dict],
+        embeddings: list[Optional[np.ndarray]],
+        session: AsyncSession
+    ):
+        rows = []
+        for event, embedding in zip(events, embeddings):
+            payload = event['payload']
+            text = payload.get('text')
+
+            if embedding is None and text:
+                emb_array = await embedding_model.encode_async(text)
                 embedding = emb_array[0] if emb_array.ndim == 2 else emb_array
+                embedding = embedding.astype(np.float16)
+
+            rows.append({
+                'id': payload['id'],
+                'author_id': payload.get('authorId'),
+                'text': text,
+                'photo_url': payload.get('photoUrl'),
+                'embedding': embedding,
+                'created_at': parse_timestamp(payload['createdAt'])
+            })
+
+        author_uids = await user_directory.resolve_many({row['author_id'] for row in rows}, session)
+        for row in rows:
+            row['author_id'] = author_uids[row['author_id']]
+
+        # redelivered events hit the primary key and insert nothing
+        result = await session.execute(
+            pg_insert(Post)
+            .values(rows)
+            .on_conflict_do_nothing(index_elements=['id'])
+            .returning(Post.id)
+        )
+        inserted = set(result.scalars().all())
 
-            post = Post(
-                id=post_id,
-                author_id=payload.get('authorId'),
-                text=text,
-                photo_url=payload.get('photoUrl'),
-                embedding=embedding,
-                created_at=created_at
-            )
-            session.add(post)
-            await session.commit()
-
-            logger.info(f"Created post {post_id}")
+        for row in rows:
+            if row['id'] in inserted:
+                logger.info(f"Created post {row['id']}")
+            else:
+                logger.warning(f"Post {row['id']} already exists, skipping")
 
-    async def _handle_post_updated(self, event: dict):
+    async def _handle_post_updated(self, event: dict, session: AsyncSession, embedding: Optional[np.ndarray] = None):
         payload = event['payload']
         post_id = payload['id']
         new_text = payload.get('text')
 
-        async with async_session_factory() as session:
-            result = await session.execute(
-                select(Post).where(Post.id == post_id)
-            )
-            post = result.scalar_one_or_none()
+        if embedding is None and new_text:
+            emb_array = await embedding_model.encode_async(new_text)
+            embedding = (emb_array[0] if emb_array.ndim == 2 else emb_array).astype(np.float16)
 
-            if not post:
-                logger.warning(f"Post {post_id} not found for update")
-                return
-
-            post.text = new_text
+        # one UPDATE ... RETURNING instead of loading the row and flushing it back
+        result = await session.execute(
+            UPDATE_POST,
+            {"post_id": post_id, "new_text": new_text, "new_embedding": embedding}
+        )
 
-            if new_text:
-                emb_array = embedding_model.encode(new_text)
-                post.embedding = emb_array[0] if emb_array.ndim == 2 else emb_array
-            else:
-                post.embedding = None
+        if result.scalar_one_or_none() is None:
+            logger.warning(f"Post {post_id} not found for update")
+            return
 
-            await session.commit()
-            logger.info(f"Updated post {post_id}")
+        logger.info(f"Updated post {post_id}")
 
-    async def _handle_post_deleted(self, event: dict):
+    async def _handle_post_deleted(self, event: dict, session: AsyncSession, embedding: Optional[np.ndarray] = None):
         payload = event['payload']
         post_id = payload['id']
 
-        async with async_session_factory() as session:
-            result = await session.execute(
-                select(Post).where(Post.id == post_id)
-            )
-            post = result.scalar_one_or_none()
+        result = await session.execute(DELETE_POST, {"post_id": post_id})
+
+        if result.scalar_one_or_none() is not None:
+            logger.info(f"Deleted post {post_id}")
+        else:
+            logger.warning(f"Post {post_id} not found for deletion")
+
+    async def _handle_reaction_created(
+        self,
+        event: dict,
+        session: AsyncSession,
+        embedding: Optional[np.ndarray] = None
+    ) -> set[str]:
+        return await self._handle_reactions_created([event], session)
+
+    async def _handle_reactions_created(self, events: list[dict], session: AsyncSession) -> set[str]:
+        payloads = [event['payload'] for event in events]
+
+        author_uids = await user_directory.resolve_many({p['authorId'] for p in payloads}, session)
+
+        result = await session.execute(
+            pg_insert(Reaction)
+            .values([
+                {
+                    'id': p['id'],
+                    'target_id': p['targetId'],
+                    'author_id': author_uids[p['authorId']],
+                    'type': p['type'],
+                    'created_at': parse_timestamp(p['createdAt'])
+                }
+                for p in payloads
+            ])
+            .on_conflict_do_nothing(index_elements=['id', 'author_id'])
+            .returning(Reaction.id, Reaction.author_id)
+        )
+        inserted = set(result.all())
 
-            if post:
-                await session.delete(post)
-                await session.commit()
-                logger.info(f"Deleted post {post_id}")
+        changed_authors = set()
+        for p in payloads:
+            if (p['id'], author_uids[p['authorId']]) in inserted:
+                changed_authors.add(p['authorId'])
             else:
-                logger.warning(f"Post {post_id} not found for deletion")
-
-    async def _handle_reaction_created(self, event: dict):
-        payload = event['payload']
-        reaction_id = payload['id']
-        author_id = payload['authorId']
+                logger.warning(f"Reaction {p['id']} already exists, skipping")
 
-        created_at = parse_timestamp(payload['createdAt'])
+        logger.info(f"Created {len(inserted)} reactions for {len(changed_authors)} users")
+        return changed_authors
 
-        async with async_session_factory() as session:
-            result = await session.execute(
-                select(Reaction).where(Reaction.id == reaction_id)
-            )
-            if result.scalar_one_or_none():
-                logger.warning(f"Reaction {reaction_id} already exists, skipping")
-                return
-
-            reaction = Reaction(
-                id=reaction_id,
-                target_id=payload['targetId'],
-                author_id=author_id,
-                type=payload['type'],
-                created_at=created_at
-            )
-            session.add(reaction)
-            await session.commit()
-
-            await recommender.invalidate_user_preference(
-                author_id,
-                session,
-                recommendation_service.redis_client
-            )
-
-            logger.info(f"Created reaction {reaction_id}, invalidated preferences for {author_id}")
-
-    async def _handle_reaction_updated(self, event: dict):
+    async def _handle_reaction_updated(
+        self,
+        event: dict,
+        session: AsyncSession,
+        embedding: Optional[np.ndarray] = None
+    ) -> set[str]:
         payload = event['payload']
         reaction_id = payload['id']
         author_id = payload['authorId']
 
-        async with async_session_factory() as session:
-            result = await session.execute(
-                select(Reaction).where(Reaction.id == reaction_id)
-            )
-            reaction = result.scalar_one_or_none()
-
-            if not reaction:
-                logger.warning(f"Reaction {reaction_id} not found for update")
-                return
-
-            reaction.type = payload['type']
-            await session.commit()
+        uid = await user_directory.lookup(author_id, session)
+        result = await session.execute(
+            UPDATE_REACTION,
+            {"reaction_id": reaction_id, "author_uid": uid, "new_type": payload['type']}
+        )
 
-            await recommender.invalidate_user_preference(
-                author_id,
-                session,
-                recommendation_service.redis_client
-            )
+        if result.scalar_one_or_none() is None:
+            logger.warning(f"Reaction {reaction_id} not found for update")
+            return set()
 
-            logger.info(f"Updated reaction {reaction_id}, invalidated preferences for {author_id}")
+        logger.info(f"Updated reaction {reaction_id}")
+        return {author_id}
 
-    async def _handle_reaction_deleted(self, event: dict):
+    async def _handle_reaction_deleted(
+        self,
+        event: dict,
+        session: AsyncSession,
+        embedding: Optional[np.ndarray] = None
+    ) -> set[str]:
         payload = event['payload']
         reaction_id = payload['id']
         author_id = payload['authorId']
 
-        async with async_session_factory() as session:
-            result = await session.execute(
-                select(Reaction).where(Reaction.id == reaction_id)
-            )
-            reaction = result.scalar_one_or_none()
+        uid = await user_directory.lookup(author_id, session)
+        result = await session.execute(
+            DELETE_REACTION,
+            {"reaction_id": reaction_id, "author_uid": uid}
+        )
 
-            if reaction:
-                await session.delete(reaction)
-                await session.commit()
+        if result.scalar_one_or_none() is None:
+            logger.warning(f"Reaction {reaction_id} not found for deletion")
+            return set()
 
-                await recommender.invalidate_user_preference(
-                    author_id,
-                    session,
-                    recommendation_service.redis_client
-                )
-                logger.info(f"Deleted reaction {reaction_id}, invalidated preferences for {author_id}")
-            else:
-                logger.warning(f"Reaction {reaction_id} not found for deletion")
+        logger.info(f"Deleted reaction {reaction_id}")
+        return {author_id}
 
     async def stop(self):
         self.running = False
+
+        # let the current poll finish and commit its offsets before leaving the group
+        if self._consume_task:
+            await self._consume_task
+
         if self.consumer:
             await self.consumer.stop()
             logger.info("Kafka consumer stopped")
 
+        # anything left queued if _consume stopped on an error
+        for queue in self._shard_queues:
+            await queue.join()
+        for task in self._shard_tasks:
+            task.cancel()
+
 
 kafka_consumer = KafkaConsumerService()
\ No newline at end of file
@@ -1,9 +1,11 @@
-from app.ml.embeddings import embedding_model, EmbeddingModel
+from app.ml.embeddings import embedding_model, EmbeddingModel, embedding_batcher, EmbeddingBatcher
 from app.ml.recommender import recommender, ContentBasedRecommender
 
 __all__ = [
     "embedding_model",
     "EmbeddingModel",
+    "embedding_batcher",
+    "EmbeddingBatcher",
     "recommender",
     "ContentBasedRecommender",
 ]
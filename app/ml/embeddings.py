@@ -1,3 +1,11 @@
+import asyncio
+import fcntl
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+import torch
 from sentence_transformers import SentenceTransformer
 from typing import Optional
 import numpy as np
@@ -5,6 +13,9 @@ from loguru import logger
 from config import settings
 
 
+SEQUENCE_BUCKETS = (64, 128, 256)
+
+
 class EmbeddingModel:
 
     _instance: Optional['EmbeddingModel'] = None
@@ -15,60 +26,266 @@ class EmbeddingModel:
         return cls._instance
     
     def __init__(self):
-        if not hasattr(self, 'model'):
-            logger.info(f"Loading embedding model: {settings.MODEL_NAME}")
-            self.model = SentenceTransformer(settings.MODEL_NAME)
+        if not hasattr(self, 'backend'):
+            self.backend = settings.EMBEDDING_BACKEND
+            logger.info(f"Loading embedding model: {settings.MODEL_NAME} (backend: {self.backend})")
+            if self.backend == "onnx":
+                self._load_onnx()
+            else:
+                self._load_torch()
             self.dimension = settings.EMBEDDING_DIMENSION
+            # one worker: forward passes on the same model/device run one at a time anyway
+            self._encode_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="encode")
             logger.info(f"Model loaded successfully. Dimension: {self.dimension}")
     
+    def _load_torch(self):
+        self.model = SentenceTransformer(settings.MODEL_NAME)
+        self.device = self.model.device
+        self.device_type = self.device.type
+        # encode calls the tokenizer and transformer directly, skipping SentenceTransformer.encode bookkeeping
+        self.tokenizer = self.model.tokenizer
+        self.transformer = self.model[0].auto_model
+        self.transformer.eval()
+        # truncate where SentenceTransformer.encode would, per model
+        self.max_length = self.model.max_seq_length
+
+        if self.device_type == "cpu":
+            # same split as the ONNX session, so uvicorn workers don't oversubscribe the cores
+            torch.set_num_threads(max(1, (os.cpu_count() or 1) // settings.WORKERS))
+
+        precision = settings.EMBEDDING_PRECISION
+        if precision == "auto":
+            precision = "fp16" if self.device_type == "cuda" else "fp32"
+        elif precision == "fp16" and self.device_type != "cuda":
+            # CPUs have no fast fp16 matmul
+            precision = "fp32"
+
+        self.autocast_dtype = None
+        if precision == "fp16":
+            self.model.half()
+        elif precision == "bf16":
+            # bf16 weights aren't supported by every op, autocast keeps the sensitive ones in fp32
+            self.autocast_dtype = torch.bfloat16
+        logger.info(f"Embedding inference precision: {precision} on {self.device_type}")
+
+    def _export_onnx(self, gpu: bool):
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTOptimizer, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig, OptimizationConfig
+
+        # intermediate files go to a private directory, only the finished model is moved into place
+        export_dir = tempfile.mkdtemp(dir=os.path.dirname(settings.ONNX_MODEL_PATH) or ".")
+        logger.info(f"Exporting {settings.MODEL_NAME} to ONNX in {export_dir}")
+
+        try:
+            model = ORTModelForFeatureExtraction.from_pretrained(settings.MODEL_NAME, export=True)
+            optimizer = ORTOptimizer.from_pretrained(model)
+            optimizer.optimize(
+                save_dir=export_dir,
+                optimization_config=OptimizationConfig(optimization_level=99, optimize_for_gpu=gpu)
+            )
+            exported = os.path.join(export_dir, "model_optimized.onnx")
+
+            if not gpu:
+                # dynamic int8 quantization of the linear layers, CPU only
+                quantizer = ORTQuantizer.from_pretrained(export_dir, file_name="model_optimized.onnx")
+                quantizer.quantize(
+                    save_dir=export_dir,
+                    quantization_config=AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+                )
+                exported = os.path.join(export_dir, "model_optimized_quantized.onnx")
+
+            os.replace(exported, settings.ONNX_MODEL_PATH)
+        finally:
+            shutil.rmtree(export_dir, ignore_errors=True)
+
+    def _load_onnx(self):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        available = ort.get_available_providers()
+        providers = [
+            p for p in ("TensorrtExecutionProvider", "CUDAExecutionProvider") if p in available
+        ] + ["CPUExecutionProvider"]
+
+        if not os.path.exists(settings.ONNX_MODEL_PATH):
+            # every uvicorn worker gets here at import; the first one exports, the others wait and load its file
+            os.makedirs(os.path.dirname(settings.ONNX_MODEL_PATH) or ".", exist_ok=True)
+            with open(f"{settings.ONNX_MODEL_PATH}.lock", "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                if not os.path.exists(settings.ONNX_MODEL_PATH):
+                    self._export_onnx(gpu=len(providers) > 1)
+
+        session_options = ort.SessionOptions()
+        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # every uvicorn worker loads its own session, split the cores between them
+        session_options.intra_op_num_threads = max(1, (os.cpu_count() or 1) // settings.WORKERS)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(settings.MODEL_NAME)
+        # the model's own limit, kept within the largest bucket so padding never has to grow past it
+        self.max_length = min(self.tokenizer.model_max_length, SEQUENCE_BUCKETS[-1])
+        self.session = ort.InferenceSession(
+            settings.ONNX_MODEL_PATH,
+            sess_options=session_options,
+            providers=providers
+        )
+        self.onnx_input_names = {i.name for i in self.session.get_inputs()}
+        # TensorRT builds an engine per input shape, CUDA and CPU run any length without that cost
+        self.pad_to_buckets = "TensorrtExecutionProvider" in self.session.get_providers()
+        logger.info(f"ONNX Runtime providers: {self.session.get_providers()}")
+
+    def _pad_to_bucket(self, encoded) -> dict:
+        # a few fixed sequence lengths let TensorRT reuse the same engines instead of building one per length
+        length = encoded["input_ids"].shape[1]
+        bucket = next((b for b in SEQUENCE_BUCKETS if b >= length), length)
+        if bucket == length:
+            return dict(encoded)
+
+        padded = {}
+        for name, values in encoded.items():
+            fill = self.tokenizer.pad_token_id if name == "input_ids" else 0
+            padded[name] = np.pad(values, ((0, 0), (0, bucket - length)), constant_values=fill)
+        return padded
+    
+    def _encode_onnx(self, texts: list[str], batch_size: int) -> np.ndarray:
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            encoded = self.tokenizer(
+                texts[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors="np"
+            )
+            if self.pad_to_buckets:
+                encoded = self._pad_to_bucket(encoded)
+            inputs = {k: v for k, v in encoded.items() if k in self.onnx_input_names}
+            token_embeddings = self.session.run(None, inputs)[0]
+
+            # mean pooling over real tokens, then L2 normalization (same as the sentence-transformers pipeline)
+            mask = encoded["attention_mask"][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.linalg.norm(pooled, axis=1, keepdims=True) + 1e-10
+            batches.append(pooled.astype(np.float32))
+
+        return np.concatenate(batches)
+
+    def _encode_torch(self, texts: list[str], batch_size: int) -> np.ndarray:
+        autocast = (
+            torch.autocast(device_type=self.device_type, dtype=self.autocast_dtype)
+            if self.autocast_dtype is not None else nullcontext()
+        )
+
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            encoded = self.tokenizer(
+                texts[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors="np"
+            )
+            inputs = {k: torch.from_numpy(v).to(self.device) for k, v in encoded.items()}
+
+            with torch.inference_mode(), autocast:
+                token_embeddings = self.transformer(**inputs).last_hidden_state.float()
+
+                # same mean pooling + L2 normalization as the sentence-transformers pipeline, done in float32
+                mask = inputs["attention_mask"].unsqueeze(-1).float()
+                pooled = (token_embeddings * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+                pooled = torch.nn.functional.normalize(pooled, dim=1)
+
+            batches.append(pooled.cpu().numpy())
+
+        return np.concatenate(batches)
+    
     def encode(self, texts: str | list[str], batch_size: int = 32) -> np.ndarray:
 
         if isinstance(texts, str):
             texts = [texts]
         
-        # Filter out None and empty strings
-        valid_texts = [t for t in texts if t and t.strip()]
+        # None and empty strings get a zero row, so row i always belongs to texts[i]
+        valid_indexes = [i for i, t in enumerate(texts) if t and t.strip()]
+        embeddings = np.zeros((len(texts), self.dimension), dtype=np.float32)
         
-        if not valid_texts:
-            # Return zero vector if no valid text
-            return np.zeros((len(texts), self.dimension))
-        
-        embeddings = self.model.encode(
-            valid_texts,
-            batch_size=batch_size,
-            show_progress_bar=False,
-            convert_to_numpy=True,
-        )
+        if not valid_indexes:
+            return embeddings
         
+        valid_texts = [texts[i] for i in valid_indexes]
+        if self.backend == "onnx":
+            encoded = self._encode_onnx(valid_texts, batch_size)
+        else:
+            encoded = self._encode_torch(valid_texts, batch_size)
+
+        if len(valid_indexes) == len(texts):
+            return encoded
+        embeddings[valid_indexes] = encoded
         return embeddings
-    
-    def compute_similarity(self, embedding1: np.ndarray, embedding2: np.ndarray) -> float:
 
-        # Normalize embeddings
-        norm1 = np.linalg.norm(embedding1)
-        norm2 = np.linalg.norm(embedding2)
-        
-        if norm1 == 0 or norm2 == 0:
-            return 0.0
-        
-        # Cosine similarity
-        similarity = np.dot(embedding1, embedding2) / (norm1 * norm2)
-        return float(similarity)
-    
-    def compute_similarities(self, query_embedding: np.ndarray, embeddings: np.ndarray) -> np.ndarray:
+    async def encode_async(self, texts: str | list[str], batch_size: int = 32) -> np.ndarray:
+        # torch/ORT release the GIL during inference, so the event loop keeps serving while a batch runs
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._encode_executor, self.encode, texts, batch_size)
 
-        # Normalize query
-        query_norm = query_embedding / (np.linalg.norm(query_embedding) + 1e-10)
-        
-        # Normalize all embeddings
-        norms = np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-10
-        normalized_embeddings = embeddings / norms
-        
-        # Compute similarities
-        similarities = np.dot(normalized_embeddings, query_norm)
-        
-        return similarities
+
+def to_numpy(embedding) -> np.ndarray:
+    # asyncpg decodes halfvec to float32 ndarrays; other drivers return pgvector HalfVector
+    if hasattr(embedding, 'to_numpy'):
+        embedding = embedding.to_numpy()
+    return np.asarray(embedding, dtype=np.float32)
+
+
+class EmbeddingBatcher:
+    """Coalesces concurrent single-text encode calls into one model forward pass"""
+
+    def __init__(self, model: EmbeddingModel):
+        self.model = model
+        self._pending: list[tuple[str, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def embed(self, text: str) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+
+        if len(self._pending) >= settings.EMBEDDING_BATCH_MAX_SIZE:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(settings.EMBEDDING_BATCH_MAX_WAIT_MS / 1000, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        task = asyncio.create_task(self._encode_batch(pending))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _encode_batch(self, pending: list[tuple[str, asyncio.Future]]):
+        # identical texts in one window share a single forward pass
+        unique_texts = list(dict.fromkeys(text for text, _ in pending))
+
+        try:
+            embeddings = await self.model.encode_async(unique_texts, batch_size=len(unique_texts))
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        by_text = dict(zip(unique_texts, embeddings))
+        for text, future in pending:
+            if not future.done():
+                future.set_result(by_text[text])
 
 
 # Singleton instance
 embedding_model = EmbeddingModel()
+embedding_batcher = EmbeddingBatcher(embedding_model)
@@ -1,39 +1,101 @@
+import math
 from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import Optional
 
 import numpy as np
 import redis.asyncio as aioredis
 from loguru import logger
-from sqlalchemy import select, and_, not_, text
+from pgvector.sqlalchemy import avg
+from sqlalchemy import select, and_, bindparam, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database.models import Post, Reaction, UserPreference
-from app.ml.embeddings import embedding_model
+from app.database.models import AsyncpgHalfVec, Post, Reaction, User, UserPreference
+from app.database.postgres import recent_index_cutoff
+from app.database.users import user_directory
+from app.ml.embeddings import embedding_model, to_numpy
 from app.models.post import PostWithEmbedding
 from config import settings
 
+# built once per index cutoff so requests reuse the same SQL and server-side prepared plan.
+# The planner can only pick the partial idx_posts_ml_embedding_bin_recent when the query
+# repeats its literal predicate, a bound :cutoff alone does not prove the implication
+# for a generic plan; :cutoff still narrows the scan to the recommendation window.
+# Hamming distance over sign bits picks a shortlist, exact cosine re-ranks it.
+# :user_id is the users_ml surrogate key, author ids go back out as external ids.
+@lru_cache(maxsize=2)
+def candidate_posts_query(index_cutoff: datetime):
+    return text(f"""
+        WITH shortlist AS (
+            SELECT p.id
+            FROM posts_ml p
+            WHERE p.embedding IS NOT NULL
+              AND p.created_at > '{index_cutoff:%Y-%m-%d %H:%M:%S}'::timestamp
+              AND p.created_at > :cutoff
+              AND (NOT :exclude_author_posts OR p.author_id <> :user_id)
+              AND NOT EXISTS (
+                  SELECT 1 FROM reactions_ml r
+                  WHERE r.author_id = :user_id AND r.target_id = p.id
+              )
+            ORDER BY p.embedding_bin <~> binary_quantize(CAST(:q AS halfvec(384)))::bit(384)
+            LIMIT :shortlist_size
+        )
+        SELECT p.id, u.external_id AS author_id, p.text, p.photo_url, p.created_at,
+               p.embedding <=> :q AS distance
+        FROM posts_ml p
+        JOIN shortlist s ON s.id = p.id
+        JOIN users_ml u ON u.id = p.author_id
+        ORDER BY distance
+        LIMIT :k
+    """).bindparams(bindparam("q", type_=AsyncpgHalfVec(384)))
+
+# an HNSW scan yields at most ef_search rows, so the shortlist sets it for its own transaction only
+SET_EF_SEARCH = text("SELECT set_config('hnsw.ef_search', :ef_search, true)")
+HNSW_MAX_EF_SEARCH = 1000
+
+# age < 1h -> bucket 0, 1h <= age < 6h -> bucket 1, ..., age >= 7d -> last bucket
+RECENCY_AGE_LIMITS = np.array([
+    timedelta(hours=1),
+    timedelta(hours=6),
+    timedelta(hours=24),
+    timedelta(days=3),
+    timedelta(days=7),
+], dtype='timedelta64[us]')
+RECENCY_BOOSTS = np.array([
+    settings.RECENCY_BOOST_1H,
+    settings.RECENCY_BOOST_6H,
+    settings.RECENCY_BOOST_24H,
+    settings.RECENCY_BOOST_3D,
+    settings.RECENCY_BOOST_7D,
+    settings.RECENCY_BOOST_DEFAULT,
+], dtype=np.float32)
+
+
+def quantize_preference(embedding: np.ndarray) -> bytes:
+    # float32 scale followed by int8 values: D + 4 bytes per user instead of 4 * D
+    scale = np.float32(np.abs(embedding).max() / 127) or np.float32(1.0)
+    quantized = np.round(embedding / scale).astype(np.int8)
+    return scale.tobytes() + quantized.tobytes()
+
+
+def dequantize_preference(data: bytes) -> np.ndarray:
+    # entries written before int8 quantization are plain float32
+    if len(data) == 4 * embedding_model.dimension:
+        return np.frombuffer(data, dtype=np.float32)
+
+    scale = np.frombuffer(data, dtype=np.float32, count=1)[0]
+    return np.frombuffer(data, dtype=np.int8, offset=4).astype(np.float32) * scale
+
 
 class ContentBasedRecommender:
 
     def __init__(self):
         self.model = embedding_model
 
-    def _calculate_recency_boost(self, created_at: datetime) -> float:
-        now = datetime.utcnow()
-        age = now - created_at
-
-        if age < timedelta(hours=1):
-            return settings.RECENCY_BOOST_1H
-        elif age < timedelta(hours=6):
-            return settings.RECENCY_BOOST_6H
-        elif age < timedelta(hours=24):
-            return settings.RECENCY_BOOST_24H
-        elif age < timedelta(days=3):
-            return settings.RECENCY_BOOST_3D
-        elif age < timedelta(days=7):
-            return settings.RECENCY_BOOST_7D
-        else:
-            return settings.RECENCY_BOOST_DEFAULT
+    def _calculate_recency_boosts(self, created_ats: list[datetime]) -> np.ndarray:
+        ages = np.datetime64(datetime.utcnow(), 'us') - np.array(created_ats, dtype='datetime64[us]')
+        return RECENCY_BOOSTS[np.searchsorted(RECENCY_AGE_LIMITS, ages, side='right')]
 
     async def _get_preference_from_redis(
             self,
@@ -45,7 +107,7 @@ class ContentBasedRecommender:
             cached_data = await redis_client.get(cache_key)
 
             if cached_data:
-                preference = np.frombuffer(cached_data, dtype=np.float32)
+                preference = dequantize_preference(cached_data)
                 logger.info(f"Loaded preference from Redis for user {user_id}")
                 return preference
         except Exception as e:
@@ -61,11 +123,10 @@ class ContentBasedRecommender:
     ):
         try:
             cache_key = f"preference:{user_id}"
-            embedding_bytes = embedding.astype(np.float32).tobytes()
             await redis_client.setex(
                 cache_key,
                 settings.PREFERENCE_CACHE_TTL,
-                embedding_bytes
+                quantize_preference(embedding)
             )
             logger.info(f"Cached preference in Redis for user {user_id} (TTL: 24h)")
         except Exception as e:
@@ -82,13 +143,18 @@ class ContentBasedRecommender:
             if redis_preference is not None:
                 return redis_preference
 
+        uid = await user_directory.lookup(user_id, session)
+        if uid is None:
+            # never posted or reacted, nothing to learn a preference from
+            return None
+
         result = await session.execute(
-            select(UserPreference).where(UserPreference.user_id == user_id)
+            select(UserPreference).where(UserPreference.user_id == uid)
         )
         user_pref = result.scalar_one_or_none()
 
         if user_pref is not None and user_pref.preference_embedding is not None:
-            embedding = np.array(user_pref.preference_embedding)
+            embedding = to_numpy(user_pref.preference_embedding)
 
             if embedding.size == 0:
                 logger.warning(f"Empty embedding for user {user_id}")
@@ -132,62 +198,43 @@ class ContentBasedRecommender:
             user_id: str,
             session: AsyncSession
     ) -> Optional[np.ndarray]:
-        result = await session.execute(
-            select(Reaction).where(Reaction.author_id == user_id)
-        )
-        reactions = result.scalars().all()
-
-        if not reactions:
-            logger.info(f"No reactions found for user {user_id}")
+        uid = await user_directory.lookup(user_id, session)
+        if uid is None:
             return None
 
-        liked_post_ids = [r.target_id for r in reactions if r.type == 'LIKE']
-        disliked_post_ids = [r.target_id for r in reactions if r.type == 'DISLIKE']
-
-        liked_embeddings = []
-        disliked_embeddings = []
-
-        if liked_post_ids:
-            result = await session.execute(
-                select(Post).where(
-                    and_(
-                        Post.id.in_(liked_post_ids),
-                        Post.embedding.isnot(None)
-                    )
-                )
-            )
-            liked_posts = result.scalars().all()
-            liked_embeddings = [np.array(p.embedding) for p in liked_posts]
-
-        if disliked_post_ids:
-            result = await session.execute(
-                select(Post).where(
-                    and_(
-                        Post.id.in_(disliked_post_ids),
-                        Post.embedding.isnot(None)
-                    )
+        # per-type mean of the reacted posts' embeddings, aggregated in Postgres
+        result = await session.execute(
+            select(Reaction.type, avg(Post.embedding))
+            .join(Post, Post.id == Reaction.target_id)
+            .where(
+                and_(
+                    Reaction.author_id == uid,
+                    Reaction.type.in_(('LIKE', 'DISLIKE')),
+                    Post.embedding.isnot(None)
                 )
             )
-            disliked_posts = result.scalars().all()
-            disliked_embeddings = [np.array(p.embedding) for p in disliked_posts]
+            .group_by(Reaction.type)
+        )
+        means = {reaction_type: mean for reaction_type, mean in result.all()}
 
-        if not liked_embeddings and not disliked_embeddings:
+        if not means:
             logger.info(f"No embeddings found for user {user_id}'s reactions")
             return None
 
-        preference_embedding = np.zeros(settings.EMBEDDING_DIMENSION)
-
-        if liked_embeddings:
-            liked_avg = np.mean(liked_embeddings, axis=0)
-            preference_embedding += liked_avg * settings.WEIGHT_LIKE_BOOST
+        liked_mean = to_numpy(means['LIKE']) if 'LIKE' in means else None
+        disliked_mean = to_numpy(means['DISLIKE']) if 'DISLIKE' in means else None
 
-        if disliked_embeddings:
-            disliked_avg = np.mean(disliked_embeddings, axis=0)
-            preference_embedding -= disliked_avg * settings.WEIGHT_DISLIKE_PENALTY
+        if liked_mean is not None and disliked_mean is not None:
+            preference_embedding = settings.WEIGHT_LIKE_BOOST * liked_mean - settings.WEIGHT_DISLIKE_PENALTY * disliked_mean
+        elif liked_mean is not None:
+            preference_embedding = settings.WEIGHT_LIKE_BOOST * liked_mean
+        else:
+            preference_embedding = -settings.WEIGHT_DISLIKE_PENALTY * disliked_mean
 
-        norm = np.linalg.norm(preference_embedding)
-        if norm > 0:
-            preference_embedding = preference_embedding / norm
+        # plain 1-D L2 norm, vdot skips np.linalg.norm's generic dispatch
+        norm_sq = float(np.vdot(preference_embedding, preference_embedding))
+        if norm_sq > 0:
+            preference_embedding *= 1.0 / math.sqrt(norm_sq)
 
         logger.info(f"Computed preference embedding for user {user_id}")
         return preference_embedding
@@ -198,91 +245,96 @@ class ContentBasedRecommender:
             embedding: Optional[np.ndarray],  # Разрешаем None!
             session: AsyncSession
     ):
-        result = await session.execute(
-            select(UserPreference).where(UserPreference.user_id == user_id)
+        uid = await user_directory.lookup(user_id, session)
+        if uid is None:
+            logger.info(f"Unknown user {user_id}, no preference to save")
+            return
+
+        embedding_half = embedding.astype(np.float16) if embedding is not None else None
+
+        # one upsert instead of SELECT then UPDATE/INSERT
+        insert_stmt = pg_insert(UserPreference).values(
+            user_id=uid,
+            preference_embedding=embedding_half,  # Может быть NULL
+            updated_at=datetime.utcnow()
         )
-        user_pref = result.scalar_one_or_none()
-
-
-        embedding_list = embedding.tolist() if embedding is not None else None
-
-        if user_pref:
-            user_pref.preference_embedding = embedding_list
-            user_pref.updated_at = datetime.utcnow()
-        else:
-            user_pref = UserPreference(
-                user_id=user_id,
-                preference_embedding=embedding_list,  # Может быть NULL
-                updated_at=datetime.utcnow()
+        await session.execute(
+            insert_stmt.on_conflict_do_update(
+                index_elements=[UserPreference.user_id],
+                set_={
+                    "preference_embedding": insert_stmt.excluded.preference_embedding,
+                    "updated_at": insert_stmt.excluded.updated_at,
+                }
             )
-            session.add(user_pref)
+        )
 
         await session.commit()
-        logger.info(f"Saved preference for user {user_id} (embedding: {embedding_list is not None})")
+        logger.info(f"Saved preference for user {user_id} (embedding: {embedding_half is not None})")
 
     async def get_recommendations(
             self,
             user_id: str,
+            user_embedding: Optional[np.ndarray],
             session: AsyncSession,
             limit: int = 10,
-            exclude_author_posts: bool = True,
-            redis_client: Optional[aioredis.Redis] = None
+            exclude_author_posts: bool = True
     ) -> list[PostWithEmbedding]:
-        user_embedding = await self.get_user_preference_embedding(user_id, session, redis_client)
-
         if user_embedding is None:
             logger.info(f"No preferences for user {user_id}, returning recent posts")
             return await self._get_recent_posts(user_id, session, limit, exclude_author_posts)
 
-        query = select(Post).where(Post.embedding.isnot(None))
-
-        if exclude_author_posts:
-            query = query.where(Post.author_id != user_id)
+        uid = await user_directory.lookup(user_id, session)
+        shortlist_size = max(settings.BINARY_SHORTLIST_SIZE, limit * settings.CANDIDATE_OVERSAMPLE)
+        await session.execute(SET_EF_SEARCH, {"ef_search": str(min(shortlist_size, HNSW_MAX_EF_SEARCH))})
 
+        # over-fetch nearest neighbours, then re-rank them with the recency boost
         result = await session.execute(
-            select(Reaction.target_id).where(Reaction.author_id == user_id)
+            candidate_posts_query(recent_index_cutoff()),
+            {
+                "q": user_embedding,
+                "cutoff": datetime.utcnow() - timedelta(days=settings.RECOMMENDATION_WINDOW_DAYS),
+                # an unknown user has no posts or reactions to exclude
+                "exclude_author_posts": exclude_author_posts and uid is not None,
+                "user_id": uid,
+                "k": limit * settings.CANDIDATE_OVERSAMPLE,
+                "shortlist_size": shortlist_size,
+            }
         )
-        reacted_post_ids = [row[0] for row in result.all()]
-
-        if reacted_post_ids:
-            query = query.where(not_(Post.id.in_(reacted_post_ids)))
-
-        query = query.order_by(Post.created_at.desc())
-
-        result = await session.execute(query)
-        posts = result.scalars().all()
+        posts = result.mappings().all()
 
         if not posts:
             logger.info(f"No posts available for recommendations for user {user_id}")
             return []
 
-        post_embeddings = np.array([np.array(p.embedding) for p in posts])
-        similarities = self.model.compute_similarities(user_embedding, post_embeddings)
+        # score all candidates at once and only build the posts that make the top `limit`
+        similarities = 1.0 - np.fromiter((post["distance"] for post in posts), dtype=np.float32, count=len(posts))
+        scores = similarities * self._calculate_recency_boosts([post["created_at"] for post in posts])
 
-        posts_with_scores = []
-        for post, similarity in zip(posts, similarities):
-            if similarity >= settings.MIN_SIMILARITY_THRESHOLD:
-                recency_boost = self._calculate_recency_boost(post.created_at)
-                final_score = float(similarity) * recency_boost
-
-                post_dict = {
-                    "id": post.id,
-                    "authorId": post.author_id,
-                    "text": post.text,
-                    "photoUrl": post.photo_url,
-                    "createdAt": post.created_at,
-                    "commentsCount": 0,
-                    "likesCount": 0,
-                    "dislikesCount": 0,
-                    "embedding": list(post.embedding),
-                    "similarity_score": final_score
-                }
-                posts_with_scores.append(PostWithEmbedding(**post_dict))
-
-        posts_with_scores.sort(key=lambda x: x.similarity_score or 0, reverse=True)
+        candidates = np.flatnonzero(similarities >= settings.MIN_SIMILARITY_THRESHOLD)
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+        top = candidates[np.argsort(-scores[candidates], kind='stable')]
 
-        logger.info(f"Returning {len(posts_with_scores[:limit])} recommendations for user {user_id}")
-        return posts_with_scores[:limit]
+        posts_with_scores = []
+        for i in top:
+            post = posts[i]
+            post_dict = {
+                "id": post["id"],
+                "authorId": post["author_id"],
+                "text": post["text"],
+                "photoUrl": post["photo_url"],
+                "createdAt": post["created_at"],
+                "commentsCount": 0,
+                "likesCount": 0,
+                "dislikesCount": 0,
+                # the distance is computed server-side, post vectors never cross the wire
+                "embedding": None,
+                "similarity_score": float(scores[i])
+            }
+            posts_with_scores.append(PostWithEmbedding.model_construct(**post_dict))
+
+        logger.info(f"Returning {len(posts_with_scores)} recommendations for user {user_id}")
+        return posts_with_scores
 
     async def _get_recent_posts(
             self,
@@ -291,29 +343,35 @@ class ContentBasedRecommender:
             limit: int,
             exclude_author_posts: bool
     ) -> list[PostWithEmbedding]:
-        query = select(Post).where(Post.embedding.isnot(None))
+        query = (
+            select(Post.id, User.external_id, Post.text, Post.photo_url, Post.created_at)
+            .join(User, User.id == Post.author_id)
+            .where(Post.embedding.isnot(None))
+        )
 
         if exclude_author_posts:
-            query = query.where(Post.author_id != user_id)
+            uid = await user_directory.lookup(user_id, session)
+            if uid is not None:
+                query = query.where(Post.author_id != uid)
 
         query = query.order_by(Post.created_at.desc()).limit(limit)
 
         result = await session.execute(query)
-        posts = result.scalars().all()
+        posts = result.all()
 
         results = []
         for p in posts:
             results.append(
-                PostWithEmbedding(
+                PostWithEmbedding.model_construct(
                     id=p.id,
-                    authorId=p.author_id,
+                    authorId=p.external_id,
                     text=p.text,
                     photoUrl=p.photo_url,
                     createdAt=p.created_at,
                     commentsCount=0,
                     likesCount=0,
                     dislikesCount=0,
-                    embedding=list(p.embedding),
+                    embedding=None,
                     similarity_score=None
                 )
             )
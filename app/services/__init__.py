@@ -1,6 +1,12 @@
 from app.services.recommendation_service import recommendation_service, RecommendationService
+from app.services.reaction_batcher import reaction_batcher, ReactionBatcher
+from app.services.preference_invalidator import preference_invalidator, PreferenceInvalidator
 
 __all__ = [
     "recommendation_service",
     "RecommendationService",
+    "reaction_batcher",
+    "ReactionBatcher",
+    "preference_invalidator",
+    "PreferenceInvalidator",
 ]
@@ -0,0 +1,83 @@
+import asyncio
+
+from loguru import logger
+from sqlalchemy import Integer, any_, bindparam, delete
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from app.database.models import UserPreference
+from app.database.postgres import async_session_factory
+from app.database.users import user_directory
+from app.services.recommendation_service import recommendation_service
+from config import settings
+
+DELETE_PREFERENCES = delete(UserPreference).where(
+    UserPreference.user_id == any_(bindparam("user_ids", type_=ARRAY(Integer)))
+)
+
+
+class PreferenceInvalidator:
+    """Coalesces preference invalidations from reaction bursts into one delete per interval"""
+
+    def __init__(self):
+        self._dirty: set[str] = set()
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+        logger.info("Preference invalidator started")
+
+    def mark(self, user_id: str):
+        # the in-process copy goes right away, stored preferences are dropped on the next flush
+        recommendation_service.invalidate_local_preference(user_id)
+        self._dirty.add(user_id)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.PREFERENCE_INVALIDATION_INTERVAL_MS / 1000)
+            try:
+                await self._flush()
+            except Exception as e:
+                logger.error(f"Error invalidating preferences: {e}")
+
+    async def _flush(self):
+        user_ids, self._dirty = self._dirty, set()
+        if not user_ids:
+            return
+
+        try:
+            # deleted preferences are recomputed from reactions on the next read
+            async with async_session_factory() as session:
+                uids = await user_directory.lookup_many(user_ids, session)
+                await session.execute(DELETE_PREFERENCES, {"user_ids": list(uids.values())})
+                await session.commit()
+
+            redis_client = recommendation_service.redis_client
+            if redis_client:
+                await redis_client.delete(*[f"preference:{user_id}" for user_id in user_ids])
+        except BaseException:
+            # retried on the next flush (or the one in stop() if cancelled), marks since then are merged in
+            self._dirty |= user_ids
+            raise
+
+        # drop anything cached in-process from the old rows while the flush was pending
+        for user_id in user_ids:
+            recommendation_service.invalidate_local_preference(user_id)
+
+        logger.info(f"Invalidated preferences for {len(user_ids)} users")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+        try:
+            await self._flush()
+        except Exception as e:
+            logger.error(f"Error invalidating {len(self._dirty)} preferences on shutdown: {e}")
+        logger.info("Preference invalidator stopped")
+
+
+preference_invalidator = PreferenceInvalidator()
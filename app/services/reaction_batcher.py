@@ -0,0 +1,156 @@
+import asyncio
+from datetime import timezone
+
+from loguru import logger
+
+from app.database.postgres import async_session_factory, engine
+from app.database.users import user_directory
+from app.models.reaction import ReactionCreate
+from app.services.preference_invalidator import preference_invalidator
+from config import settings
+
+REACTION_COLUMNS = ["id", "target_id", "author_id", "type", "created_at"]
+
+# queued by stop() so the worker drains everything accepted before it and then exits
+_STOP = object()
+
+
+def _to_record(reaction: ReactionCreate, author_uid: int) -> tuple:
+    created_at = reaction.created_at
+    # reactions_ml.created_at is a naive UTC timestamp
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return (
+        reaction.id,
+        reaction.target_id,
+        author_uid,
+        reaction.type.value,
+        created_at
+    )
+
+
+class ReactionBatcher:
+
+    def __init__(self):
+        self.queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=settings.REACTION_BATCH_QUEUE_SIZE)
+        self._task = asyncio.create_task(self._run())
+        logger.info("Reaction batcher started")
+
+    async def submit(self, reaction: ReactionCreate):
+        await self.queue.put(reaction)
+
+    async def _collect(self) -> tuple[list[ReactionCreate], bool]:
+        # wait for the first reaction, then keep taking more until the window closes or the batch is full
+        first = await self.queue.get()
+        if first is _STOP:
+            return [], True
+
+        batch = [first]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.REACTION_BATCH_MAX_WAIT_MS / 1000
+
+        while len(batch) < settings.REACTION_BATCH_MAX_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                reaction = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if reaction is _STOP:
+                return batch, True
+            batch.append(reaction)
+
+        return batch, False
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = await self._collect()
+            if batch:
+                await self._store(batch)
+
+    async def _store(self, batch: list[ReactionCreate]):
+        # every reaction here was already acknowledged with 202, so a failed batch is retried
+        # and then replayed one by one instead of being dropped whole
+        for attempt in range(1, settings.REACTION_BATCH_RETRY_ATTEMPTS + 1):
+            try:
+                await self._flush(batch)
+                return
+            except Exception as e:
+                logger.warning(f"Error flushing {len(batch)} reactions (attempt {attempt}): {e}")
+                await asyncio.sleep(settings.REACTION_BATCH_RETRY_BACKOFF_MS * attempt / 1000)
+
+        if len(batch) == 1:
+            logger.error(f"Dropping reaction {batch[0].id} after {settings.REACTION_BATCH_RETRY_ATTEMPTS} attempts")
+            return
+
+        logger.error(f"Batch of {len(batch)} reactions keeps failing, storing them one by one")
+        for reaction in batch:
+            try:
+                await self._flush([reaction])
+            except Exception as e:
+                logger.error(f"Dropping reaction {reaction.id}: {e}")
+
+    async def _flush(self, batch: list[ReactionCreate]):
+        author_ids = {r.author_id for r in batch}
+        # new authors must be committed before COPY references them from another connection
+        async with async_session_factory() as session, session.begin():
+            author_uids = await user_directory.resolve_many(author_ids, session)
+
+        records = [_to_record(r, author_uids[r.author_id]) for r in batch]
+
+        async with engine.connect() as conn:
+            raw_connection = await conn.get_raw_connection()
+            driver_connection = raw_connection.driver_connection
+
+            # COPY can't skip duplicates, so stage into a temp table and insert from there
+            async with driver_connection.transaction():
+                await driver_connection.execute(
+                    "CREATE TEMP TABLE reactions_ml_incoming "
+                    "(LIKE reactions_ml INCLUDING DEFAULTS) ON COMMIT DROP"
+                )
+                await driver_connection.copy_records_to_table(
+                    "reactions_ml_incoming",
+                    records=records,
+                    columns=REACTION_COLUMNS
+                )
+                await driver_connection.execute(
+                    f"INSERT INTO reactions_ml ({', '.join(REACTION_COLUMNS)}) "
+                    f"SELECT {', '.join(REACTION_COLUMNS)} FROM reactions_ml_incoming "
+                    f"ON CONFLICT (id, author_id) DO NOTHING"
+                )
+
+        logger.info(f"Stored batch of {len(records)} reactions")
+
+        for author_id in author_ids:
+            preference_invalidator.mark(author_id)
+
+    async def stop(self):
+        # don't cancel the worker mid-flush, let it drain what was accepted before shutdown
+        if self._task:
+            await self.queue.put(_STOP)
+            try:
+                await self._task
+            except Exception as e:
+                logger.error(f"Reaction batcher worker failed: {e}")
+
+        # anything submitted after the sentinel; a failure here must not abort the rest of shutdown
+        if self.queue and not self.queue.empty():
+            pending = []
+            while not self.queue.empty():
+                pending.append(self.queue.get_nowait())
+            try:
+                await self._store(pending)
+            except Exception as e:
+                logger.error(f"Error flushing {len(pending)} reactions on shutdown: {e}")
+
+        logger.info("Reaction batcher stopped")
+
+
+reaction_batcher = ReactionBatcher()
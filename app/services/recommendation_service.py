@@ -1,32 +1,49 @@
+import hashlib
+from typing import Optional
+
+import numpy as np
 import redis.asyncio as aioredis
+from cachetools import TTLCache
 from loguru import logger
+from pydantic import TypeAdapter
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database.models import Post, Reaction
-from app.ml.embeddings import embedding_model
+from app.database.models import Post
+from app.database.users import user_directory
+from app.ml.embeddings import embedding_model, embedding_batcher
 from app.ml.recommender import recommender
 from app.models.post import PostResponse, PostCreate
-from app.models.reaction import ReactionCreate
 from app.models.user import RecommendationRequest, RecommendationResponse
 from config import settings
 
+# serializes straight to JSON bytes, no intermediate dict
+RECOMMENDATION_RESPONSE_ADAPTER = TypeAdapter(RecommendationResponse)
+
 
 class RecommendationService:
 
     def __init__(self):
         self.recommender = recommender
         self.embedding_model = embedding_model
+        self.redis_pool: aioredis.BlockingConnectionPool | None = None
         self.redis_client: aioredis.Redis | None = None
+        # user_id -> float16 preference embedding, saves the Redis/PostgreSQL lookup per request
+        self.preference_cache: TTLCache = TTLCache(
+            maxsize=settings.PREFERENCE_LOCAL_CACHE_SIZE,
+            ttl=settings.PREFERENCE_LOCAL_CACHE_TTL
+        )
 
     async def init_redis(self):
         try:
-            redis_url = f"redis://:{settings.REDIS_PASSWORD}@{settings.REDIS_HOST}:{settings.REDIS_PORT}/{settings.REDIS_DB}"
-
-            self.redis_client = await aioredis.from_url(
-                redis_url,
+            # one bounded pool shared by every request; bursts wait for a connection instead of opening more
+            self.redis_pool = aioredis.BlockingConnectionPool.from_url(
+                settings.REDIS_URL,
+                max_connections=settings.REDIS_MAX_CONNECTIONS,
+                socket_keepalive=True,
                 encoding="utf-8",
                 decode_responses=False
             )
+            self.redis_client = aioredis.Redis(connection_pool=self.redis_pool)
             logger.info("Redis connection established")
         except Exception as e:
             logger.error(f"Failed to connect to Redis: {e}")
@@ -35,24 +52,114 @@ class RecommendationService:
     async def close_redis(self):
         if self.redis_client:
             await self.redis_client.close()
+            # a client built on an explicit pool leaves the pool open
+            await self.redis_pool.disconnect()
             logger.info("Redis connection closed")
 
+    async def get_user_preference(
+            self,
+            user_id: str,
+            session: AsyncSession
+    ) -> Optional[np.ndarray]:
+        cached = self.preference_cache.get(user_id)
+        if cached is not None:
+            return cached
+
+        embedding = await self.recommender.get_user_preference_embedding(
+            user_id,
+            session,
+            self.redis_client
+        )
+
+        if embedding is not None:
+            # the candidate query binds it as halfvec anyway, so one read-only float16 buffer serves
+            # the local cache, the result cache key and the query, hit or miss alike
+            embedding = embedding.astype(np.float16)
+            embedding.flags.writeable = False
+            self.preference_cache[user_id] = embedding
+
+        return embedding
+
+    async def refresh_user_preference(self, user_id: str, session: AsyncSession) -> Optional[np.ndarray]:
+        self.invalidate_local_preference(user_id)
+        await self.invalidate_recommendation_cache(user_id)
+        await self.recommender.invalidate_user_preference(user_id, session, self.redis_client)
+        return await self.get_user_preference(user_id, session)
+
+    def invalidate_local_preference(self, user_id: str):
+        # only this worker's copy, other workers keep theirs until PREFERENCE_LOCAL_CACHE_TTL
+        self.preference_cache.pop(user_id, None)
+
+    def _recommendation_cache_key(self, request: RecommendationRequest, user_embedding: Optional[np.ndarray]) -> str:
+        # the preference hash makes entries computed from an outdated preference unreachable
+        preference_bytes = user_embedding if user_embedding is not None else b""
+        preference_hash = hashlib.blake2b(preference_bytes, digest_size=8).hexdigest()
+        return f"rec:{request.user_id}:{preference_hash}:{request.limit}:{int(request.exclude_author_posts)}"
+
+    async def _get_cached_recommendations(self, cache_key: str) -> Optional[bytes]:
+        if not self.redis_client:
+            return None
+
+        try:
+            cached_data = await self.redis_client.get(cache_key)
+            if cached_data:
+                return cached_data
+        except Exception as e:
+            logger.error(f"Error getting recommendations from Redis: {e}")
+
+        return None
+
+    async def _cache_recommendations(self, user_id: str, cache_key: str, body: bytes):
+        if not self.redis_client:
+            return
+
+        try:
+            # the per-user index lets invalidation delete exactly this user's keys, no keyspace scan
+            index_key = f"rec-keys:{user_id}"
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.set(cache_key, body, ex=settings.RECOMMENDATION_CACHE_TTL)
+                pipe.sadd(index_key, cache_key)
+                pipe.expire(index_key, settings.RECOMMENDATION_CACHE_TTL)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Error caching recommendations in Redis: {e}")
+
+    async def invalidate_recommendation_cache(self, user_id: str):
+        if not self.redis_client:
+            return
+
+        try:
+            index_key = f"rec-keys:{user_id}"
+            keys = await self.redis_client.smembers(index_key)
+            await self.redis_client.delete(index_key, *keys)
+        except Exception as e:
+            logger.error(f"Error invalidating recommendations in Redis: {e}")
+
     async def get_recommendations(
             self,
             request: RecommendationRequest,
             session: AsyncSession
-    ) -> RecommendationResponse:
+    ) -> bytes:
+        """Returns the RecommendationResponse JSON body; cache hits are served as stored, without re-encoding"""
+
+        user_embedding = await self.get_user_preference(request.user_id, session)
+
+        cache_key = self._recommendation_cache_key(request, user_embedding)
+        cached = await self._get_cached_recommendations(cache_key)
+        if cached is not None:
+            return cached
 
         recommended_posts = await self.recommender.get_recommendations(
             user_id=request.user_id,
+            user_embedding=user_embedding,
             session=session,
             limit=request.limit,
-            exclude_author_posts=request.exclude_author_posts,
-            redis_client=self.redis_client
+            exclude_author_posts=request.exclude_author_posts
         )
 
+        # the recommender built these rows itself, so skip validation and only serialize
         post_responses = [
-            PostResponse(
+            PostResponse.model_construct(
                 id=p.id,
                 authorId=p.author_id,
                 text=p.text,
@@ -65,42 +172,44 @@ class RecommendationService:
             for p in recommended_posts
         ]
 
-        response = RecommendationResponse(
-            user_id=request.user_id,
-            recommendations=post_responses,
-            total_count=len(post_responses)
+        body = RECOMMENDATION_RESPONSE_ADAPTER.dump_json(
+            RecommendationResponse.model_construct(
+                user_id=request.user_id,
+                recommendations=post_responses,
+                total_count=len(post_responses)
+            ),
+            by_alias=True
         )
 
-        return response
+        await self._cache_recommendations(request.user_id, cache_key, body)
+
+        return body
 
     async def create_post(self, post_data: PostCreate, session: AsyncSession) -> PostResponse:
         embedding = None
-        if post_data.text:
-            embedding_array = self.embedding_model.encode(post_data.text)
-
-            if embedding_array.ndim == 2:
-                embedding = embedding_array[0]
-            else:
-                embedding = embedding_array
+        if post_data.text and post_data.text.strip():
+            # batched with other concurrent post creations
+            embedding = await embedding_batcher.embed(post_data.text)
+            embedding = embedding.astype(np.float16)
 
         post = Post(
             id=post_data.id,
-            author_id=post_data.author_id,
+            author_id=await user_directory.resolve(post_data.author_id, session),
             text=post_data.text,
             photo_url=post_data.photo_url,
             created_at=post_data.created_at,
             embedding=embedding
         )
 
+        # every returned field was set here and sessions don't expire on commit, so no refresh SELECT
         session.add(post)
         await session.commit()
-        await session.refresh(post)
 
         logger.info(f"Created post {post.id} with embedding")
 
         return PostResponse(
             id=post.id,
-            authorId=post.author_id,
+            authorId=post_data.author_id,
             text=post.text,
             photoUrl=post.photo_url,
             createdAt=post.created_at,
@@ -109,30 +218,6 @@ class RecommendationService:
             dislikesCount=0
         )
 
-    async def create_reaction(
-            self,
-            reaction_data: ReactionCreate,
-            session: AsyncSession
-    ):
-        reaction = Reaction(
-            id=reaction_data.id,
-            target_id=reaction_data.target_id,
-            author_id=reaction_data.author_id,
-            type=reaction_data.type.value,
-            created_at=reaction_data.created_at
-        )
-
-        session.add(reaction)
-        await session.commit()
-
-        logger.info(f"Created reaction {reaction.id} by user {reaction_data.author_id}")
-
-        await self.recommender.invalidate_user_preference(
-            reaction_data.author_id,
-            session,
-            self.redis_client
-        )
-
     async def invalidate_preference_redis(self, user_id: str):
         if not self.redis_client:
             return
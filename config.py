@@ -1,4 +1,6 @@
 import os
+from functools import cached_property
+
 from pydantic_settings import BaseSettings
 
 
@@ -9,6 +11,7 @@ class Settings(BaseSettings):
     DEBUG: bool
     HOST: str
     PORT: int
+    WORKERS: int = 1
 
     # PostgreSQL
     POSTGRES_HOST: str
@@ -16,13 +19,15 @@ class Settings(BaseSettings):
     POSTGRES_USER: str
     POSTGRES_PASSWORD: str
     POSTGRES_DB: str
+    PGBOUNCER_ENABLED: bool = False  # POSTGRES_HOST/PORT point at PgBouncer in transaction mode
+    PGBOUNCER_CLIENT_POOL_SIZE: int = 5  # per worker, plus as many overflow connections
 
-    @property
+    @cached_property
     def DATABASE_URL(self) -> str:
         """Async database URL for SQLAlchemy (asyncpg driver)"""
         return f"postgresql+asyncpg://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.POSTGRES_HOST}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
 
-    @property
+    @cached_property
     def DATABASE_URL_SYNC(self) -> str:
         """Sync database URL for Alembic migrations (psycopg2 driver)"""
         return f"postgresql+psycopg2://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.POSTGRES_HOST}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
@@ -32,18 +37,46 @@ class Settings(BaseSettings):
     REDIS_PORT: int
     REDIS_PASSWORD: str
     REDIS_DB: int
+    REDIS_MAX_CONNECTIONS: int = 32  # requests wait for a free connection above this
     PREFERENCE_CACHE_TTL: int = 86400
+    RECOMMENDATION_CACHE_TTL: int = 60
+
+    @cached_property
+    def REDIS_URL(self) -> str:
+        """Redis URL for redis.asyncio"""
+        return f"redis://:{self.REDIS_PASSWORD}@{self.REDIS_HOST}:{self.REDIS_PORT}/{self.REDIS_DB}"
+
+    # In-process preference cache, one per uvicorn worker: a reaction only evicts the entry in the
+    # worker that handled it, the others can serve the old preference for up to the TTL
+    PREFERENCE_LOCAL_CACHE_SIZE: int = 10_000
+    PREFERENCE_LOCAL_CACHE_TTL: int = 30
+
+    # external user id -> users_ml.id
+    USER_ID_CACHE_SIZE: int = 100_000
 
     # Kafka
     KAFKA_BOOTSTRAP_SERVERS: str
     KAFKA_GROUP_ID: str
     KAFKA_AUTO_OFFSET_RESET: str
+    KAFKA_POLL_TIMEOUT_MS: int = 20
+    KAFKA_MAX_POLL_RECORDS: int = 64
+    KAFKA_FETCH_MAX_BYTES: int = 52_428_800
+    KAFKA_MAX_PARTITION_FETCH_BYTES: int = 4_194_304
+    KAFKA_HANDLER_SHARDS: int = 4
+    KAFKA_SHARD_QUEUE_SIZE: int = 256
+    KAFKA_RETRY_BACKOFF_MS: int = 500  # transiently failed events are retried until they succeed
+    KAFKA_RETRY_BACKOFF_MAX_MS: int = 10_000
 
     # ML Model
     MODEL_NAME: str
     EMBEDDING_DIMENSION: int
     TOP_N_RECOMMENDATIONS: int
     MIN_SIMILARITY_THRESHOLD: float
+    EMBEDDING_BACKEND: str = "torch"  # "torch" or "onnx"
+    EMBEDDING_PRECISION: str = "auto"  # "auto" (fp16 on CUDA, fp32 on CPU), "fp16", "bf16" or "fp32"
+    ONNX_MODEL_PATH: str = "models/all-MiniLM-L6-v2-int8.onnx"
+    EMBEDDING_BATCH_MAX_SIZE: int = 32
+    EMBEDDING_BATCH_MAX_WAIT_MS: int = 10
 
     # Weights for recommendation scoring
     WEIGHT_CONTENT_SIMILARITY: float
@@ -58,6 +91,19 @@ class Settings(BaseSettings):
     RECENCY_BOOST_7D: float = 1.1
     RECENCY_BOOST_DEFAULT: float = 1.0
 
+    # Candidate retrieval
+    RECOMMENDATION_WINDOW_DAYS: int = 30
+    CANDIDATE_OVERSAMPLE: int = 4
+    BINARY_SHORTLIST_SIZE: int = 200  # also the hnsw.ef_search of the shortlist scan, capped at 1000
+
+    # Reaction write batching
+    REACTION_BATCH_MAX_SIZE: int = 1000
+    REACTION_BATCH_MAX_WAIT_MS: int = 50
+    REACTION_BATCH_QUEUE_SIZE: int = 10_000
+    REACTION_BATCH_RETRY_ATTEMPTS: int = 3  # flushes of a failed batch before it is stored one by one
+    REACTION_BATCH_RETRY_BACKOFF_MS: int = 200
+    PREFERENCE_INVALIDATION_INTERVAL_MS: int = 200
+
     class Config:
         env_file = os.getenv("env_file", ".env.local")
         case_sensitive = True
@@ -1,10 +1,15 @@
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from loguru import logger
 
+from app.database import init_db, close_db
 from app.kafka.consumer import kafka_consumer
 from app.api import recommendations
 from app.services.recommendation_service import recommendation_service
+from app.services.reaction_batcher import reaction_batcher
+from app.services.preference_invalidator import preference_invalidator
 from config import settings
 
 
@@ -13,13 +18,19 @@ async def lifespan(app: FastAPI):
     logger.info("Starting application...")
 
     try:
-        # Initialize Redis connection
-        await recommendation_service.init_redis()
-        logger.info("Redis initialized")
+        # Check database connection
+        await init_db()
 
-        # Start Kafka consumer in background
-        await kafka_consumer.start()
-        logger.info("Kafka consumer started")
+        # Start batched reaction writer and coalesced preference invalidation
+        await reaction_batcher.start()
+        await preference_invalidator.start()
+
+        # Redis and the Kafka group join are independent, connect to both at once
+        await asyncio.gather(
+            recommendation_service.init_redis(),
+            kafka_consumer.start()
+        )
+        logger.info("Redis initialized, Kafka consumer started")
 
     except Exception as e:
         logger.error(f"Failed to start services: {e}")
@@ -32,9 +43,14 @@ async def lifespan(app: FastAPI):
     await kafka_consumer.stop()
     logger.info("Kafka consumer stopped")
 
+    await reaction_batcher.stop()
+    await preference_invalidator.stop()
+
     await recommendation_service.close_redis()
     logger.info("Redis connection closed")
 
+    await close_db()
+
     logger.info("Application shutdown complete")
 
 
@@ -42,7 +58,8 @@ async def lifespan(app: FastAPI):
 app = FastAPI(
     title=settings.APP_NAME,
     version=settings.APP_VERSION,
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Include api routes
@@ -66,5 +83,9 @@ if __name__ == "__main__":
         "main:app",
         host=settings.HOST,
         port=settings.PORT,
-        reload=settings.DEBUG
+        reload=settings.DEBUG,
+        # ignored with reload; each worker loads its own copy of the embedding model
+        workers=settings.WORKERS,
+        loop="uvloop",
+        http="httptools"
     )
\ No newline at end of file